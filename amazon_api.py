@@ -1,14 +1,105 @@
 import requests
 from datetime import datetime, timedelta  
-from models import db, AmazonSettlementData
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from models import AmazonSellerMarketplaces
+from write_buffer import (normalize_settlement, buffer_settlements, reserve_settlement_capacity,
+                          settlement_buffer_key, DB_CHUNK_SIZE)
+from rate_limiter import acquire_quota, report_throttled, QuotaUnavailable, REQUEST_MAX_QUOTA_WAIT
 import gzip
 import shutil
 import csv
 import os
 import requests
 
-def fetch_orders_from_amazon(selling_partner_id, access_token, created_after):
-    url = "https://sellingpartnerapi-na.amazon.com/orders/v0/orders"
+# SP-API regional endpoints and the marketplaces each one serves
+SP_API_ENDPOINTS = {
+    "na": "https://sellingpartnerapi-na.amazon.com",
+    "eu": "https://sellingpartnerapi-eu.amazon.com",
+    "fe": "https://sellingpartnerapi-fe.amazon.com",
+}
+MARKETPLACE_REGIONS = {
+    "ATVPDKIKX0DER": "na",   # US
+    "A2EUQ1WTGCTBG2": "na",  # Canada
+    "A1AM78C64UM0Y8": "na",  # Mexico
+    "A2Q3Y263D00KWC": "na",  # Brazil
+    "A1F83G8C2ARO7P": "eu",  # UK
+    "A1PA6795UKMFR9": "eu",  # Germany
+    "A13V1IB3VIYZZH": "eu",  # France
+    "APJ6JRA9NG5V4": "eu",   # Italy
+    "A1RKKUPIHCS9HS": "eu",  # Spain
+    "A1805IZSGTT6HS": "eu",  # Netherlands
+    "AMEN7PMS3EDWL": "eu",   # Belgium
+    "A2NODRKZP88ZB9": "eu",  # Sweden
+    "A1C3SOZRARQ6R3": "eu",  # Poland
+    "A33AVAJ2PDY3EV": "eu",  # Turkey
+    "A2VIGQ35RCS4UG": "eu",  # UAE
+    "A17E79C6D8DWNP": "eu",  # Saudi Arabia
+    "ARBP9OOSHTCHU": "eu",   # Egypt
+    "A21TJRUUN4KGV": "eu",   # India
+    "A1VC38T7YXB528": "fe",  # Japan
+    "A39IBJ37TRP1C6": "fe",  # Australia
+    "A19VAU5U5O7RUS": "fe",  # Singapore
+}
+DEFAULT_MARKETPLACE_IDS = ["A1AM78C64UM0Y8"]  # ✅ Amazon Mexico Marketplace
+MAX_MARKETPLACES_PER_CALL = 50  # getOrders limit on MarketplaceIds
+MAX_FETCH_WORKERS = 6
+
+MAX_THROTTLE_RETRIES = 3
+
+
+class SPAPIError(Exception):
+    """SP-API answered with an error, the data fetched so far is incomplete."""
+
+    def __init__(self, operation, status_code, text):
+        super().__init__(f"SP-API {operation} failed: {status_code} - {text[:500]}")
+        self.status_code = status_code
+
+def sp_api_request(method, url, selling_partner_id, operation, region="na",
+                   max_wait=REQUEST_MAX_QUOTA_WAIT, **kwargs):
+    """Call SP-API through the shared per-seller/region/operation quota, retrying after 429s.
+
+    Raises QuotaUnavailable when the quota queue is longer than max_wait or Amazon keeps throttling.
+    """
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        acquire_quota(selling_partner_id, operation, region, max_wait)
+
+        response = requests.request(method, url, **kwargs)
+        if response.status_code != 429:
+            return response
+
+        print(f"⚠️ SP-API throttled {operation} for {selling_partner_id} in {region} (attempt {attempt + 1})")
+        report_throttled(selling_partner_id, operation, region)
+    retry_after = response.headers.get("Retry-After", "")
+    raise QuotaUnavailable(operation, int(retry_after) if retry_after.isdigit() else 60)
+
+def region_for_marketplace(marketplace_id):
+    return MARKETPLACE_REGIONS.get(marketplace_id, "na")
+
+def get_seller_marketplaces(selling_partner_id):
+    """Marketplace IDs configured for a seller, Mexico when nothing is configured."""
+    rows = AmazonSellerMarketplaces.query.filter_by(selling_partner_id=selling_partner_id).all()
+    return [row.marketplace_id for row in rows] or list(DEFAULT_MARKETPLACE_IDS)
+
+def group_marketplaces_by_region(marketplace_ids):
+    """Split marketplaces into per-region batches small enough for a single getOrders call."""
+    by_region = defaultdict(list)
+    for marketplace_id in marketplace_ids:
+        by_region[region_for_marketplace(marketplace_id)].append(marketplace_id)
+
+    batches = []
+    for region, ids in by_region.items():
+        for start in range(0, len(ids), MAX_MARKETPLACES_PER_CALL):
+            batches.append((region, ids[start:start + MAX_MARKETPLACES_PER_CALL]))
+    return batches
+
+def _fetch_region_orders(selling_partner_id, access_token, created_after, region, marketplace_ids,
+                         max_wait=REQUEST_MAX_QUOTA_WAIT):
+    """Fetch every page of orders for one region's marketplaces.
+
+    QuotaUnavailable and SPAPIError propagate, a partial page list must never pass for the complete history.
+    """
+    url = f"{SP_API_ENDPOINTS[region]}/orders/v0/orders"
 
     headers = {
         "x-amz-access-token": access_token,
@@ -16,33 +107,79 @@ def fetch_orders_from_amazon(selling_partner_id, access_token, created_after):
     }
 
     params = {
-        "MarketplaceIds": ["A1AM78C64UM0Y8"],  # ✅ Amazon Mexico Marketplace
-        "CreatedAfter": (datetime.utcnow() - timedelta(days=365)).isoformat(),  # ✅ Ensure 1 year
-        "OrderStatuses": ["Shipped", "Unshipped", "Canceled"]
+        "MarketplaceIds": ",".join(marketplace_ids),
+        "CreatedAfter": created_after,
+        "OrderStatuses": "Shipped,Unshipped,Canceled"
     }
 
-    print(f"🔍 Fetching orders for seller {selling_partner_id} since {params['CreatedAfter']}")
+    print(f"🔍 Fetching orders for seller {selling_partner_id} in {region} {marketplace_ids} since {created_after}")
 
-    response = requests.get(url, headers=headers, params=params)
+    orders = []
+    while True:
+        response = sp_api_request("GET", url, selling_partner_id, "getOrders", region, max_wait,
+                                  headers=headers, params=params)
 
-    if response.status_code == 200:
-        orders = response.json()
-        print(f"✅ Amazon API Response: {orders}")  # ✅ Debugging print
-
-        if "Orders" in orders:
-            return orders["Orders"]
-        elif "payload" in orders and "Orders" in orders["payload"]:
-            return orders["payload"]["Orders"]
-        else:
-            print("❌ No orders found in response!")
-            return []
-    else:
-        print(f"❌ Error fetching orders: {response.status_code} - {response.text}")
-        return []
+        if response.status_code != 200:
+            # Pages fetched so far are not the order history, never let them pass for it
+            print(f"❌ Error fetching {region} orders: {response.status_code} - {response.text}")
+            raise SPAPIError("getOrders", response.status_code, response.text)
 
-def request_settlement_report(access_token, selling_partner_id):
-    """Request the settlement report from Amazon."""
-    url = "https://sellingpartnerapi-na.amazon.com/reports/2021-06-30/reports"
+        data = response.json()
+        payload = data.get("payload", data)
+        page = payload.get("Orders", [])
+
+        for order in page:
+            # ✅ Single-marketplace calls can always attribute the order
+            if not order.get("MarketplaceId") and len(marketplace_ids) == 1:
+                order["MarketplaceId"] = marketplace_ids[0]
+        orders.extend(page)
+
+        next_token = payload.get("NextToken")
+        if not next_token:
+            break
+        params = {"MarketplaceIds": params["MarketplaceIds"], "NextToken": next_token}
+
+    print(f"✅ {len(orders)} orders from {region} {marketplace_ids}")
+    return orders
+
+def fetch_orders_from_amazon(selling_partner_id, access_token, created_after=None, marketplace_ids=None,
+                             max_wait=REQUEST_MAX_QUOTA_WAIT):
+    """Fetch a seller's orders from all of its marketplaces, one parallel call stream per region.
+
+    Raises QuotaUnavailable or SPAPIError instead of returning a partial result, background syncs pass a
+    longer max_wait.
+    """
+    if created_after is None:
+        created_after = (datetime.utcnow() - timedelta(days=365)).isoformat()  # ✅ Ensure 1 year
+    if marketplace_ids is None:
+        marketplace_ids = get_seller_marketplaces(selling_partner_id)
+
+    batches = group_marketplaces_by_region(marketplace_ids)
+    if len(batches) == 1:
+        region, ids = batches[0]
+        return _fetch_region_orders(selling_partner_id, access_token, created_after, region, ids, max_wait)
+
+    orders = {}
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(batches))) as executor:
+        futures = [
+            executor.submit(_fetch_region_orders, selling_partner_id, access_token, created_after, region, ids,
+                            max_wait)
+            for region, ids in batches
+        ]
+        for future in as_completed(futures):
+            for order in future.result():
+                orders[order.get("AmazonOrderId")] = order  # Merge, an order id only appears once
+
+    if not orders:
+        print("❌ No orders found in response!")
+    return list(orders.values())
+
+def request_settlement_report(access_token, selling_partner_id, marketplace_ids=None):
+    """Request the settlement report from Amazon, all marketplace_ids must share one region."""
+    if marketplace_ids is None:
+        marketplace_ids = list(DEFAULT_MARKETPLACE_IDS)
+    region = region_for_marketplace(marketplace_ids[0])
+    url = f"{SP_API_ENDPOINTS[region]}/reports/2021-06-30/reports"
 
     headers = {
         "x-amz-access-token": access_token,
@@ -53,11 +190,10 @@ def request_settlement_report(access_token, selling_partner_id):
         "reportType": "_GET_V2_SETTLEMENT_REPORT_DATA_FLAT_FILE",
         "dataStartTime": (datetime.utcnow() - timedelta(days=30)).isoformat(),  # Last 30 days
         "dataEndTime": datetime.utcnow().isoformat(),
-        "marketplaceIds": ["A1AM78C64UM0Y8"]  # Amazon Mexico Marketplace
+        "marketplaceIds": marketplace_ids
     }
 
-    response = requests.post(url, headers=headers, json=payload)
-
+    response = sp_api_request("POST", url, selling_partner_id, "createReport", region, headers=headers, json=payload)
     if response.status_code == 200:
         report_id = response.json().get("reportId")
         print(f"✅ Report requested: {report_id}")
@@ -66,15 +202,15 @@ def request_settlement_report(access_token, selling_partner_id):
         print(f"❌ Error requesting report: {response.text}")
         return None
 
-def get_report_status(access_token, report_id):
+def get_report_status(access_token, report_id, region="na", selling_partner_id=None):
     """Check the status of a requested report."""
-    url = f"https://sellingpartnerapi-na.amazon.com/reports/2021-06-30/reports/{report_id}"
+    url = f"{SP_API_ENDPOINTS[region]}/reports/2021-06-30/reports/{report_id}"
 
     headers = {
         "x-amz-access-token": access_token
     }
 
-    response = requests.get(url, headers=headers)
+    response = sp_api_request("GET", url, selling_partner_id, "getReport", region, headers=headers)
     if response.status_code == 200:
         processing_status = response.json().get("processingStatus")
         document_id = response.json().get("reportDocumentId")
@@ -84,15 +220,15 @@ def get_report_status(access_token, report_id):
         print(f"❌ Error checking report status: {response.text}")
         return None, None
 
-def download_report(access_token, document_id):
+def download_report(access_token, document_id, region="na", selling_partner_id=None):
     """Download the settlement report and extract its contents."""
-    url = f"https://sellingpartnerapi-na.amazon.com/reports/2021-06-30/documents/{document_id}"
+    url = f"{SP_API_ENDPOINTS[region]}/reports/2021-06-30/documents/{document_id}"
 
     headers = {
         "x-amz-access-token": access_token
     }
 
-    response = requests.get(url, headers=headers)
+    response = sp_api_request("GET", url, selling_partner_id, "getReportDocument", region, headers=headers)
     if response.status_code == 200:
         report_url = response.json().get("url")
 
@@ -111,26 +247,32 @@ def download_report(access_token, document_id):
         print(f"❌ Error downloading report: {response.text}")
         return None
 
-def process_settlement_report(file_path, selling_partner_id):
-    """Process and store settlement data in PostgreSQL."""
+def process_settlement_report(file_path, selling_partner_id, redis_client):
+    """Stream the settlement report into the write-behind buffer in chunks.
+
+    Capacity for the whole report is checked first, and lines are keyed by settlement id and line
+    number, so a retry after WriteBufferFull never queues the same line twice.
+    """
+    with open(file_path, mode='r', encoding="utf-8") as file:
+        total_rows = max(sum(1 for _ in file) - 1, 0)
+    reserve_settlement_capacity(redis_client, total_rows)
+
+    queued = 0
     with open(file_path, mode='r', encoding="utf-8") as file:
         reader = csv.DictReader(file)
 
-        for row in reader:
-            print(f"Processing row: {row}")  # Debugging print
-            new_entry = AmazonSettlementData(
-                selling_partner_id=selling_partner_id,
-                settlement_id=row.get("settlement_id"),
-                date_time=row.get("date_time"),
-                order_id=row.get("order_id"),
-                type=row.get("type"),
-                amount=row.get("amount"),
-                amazon_fee=row.get("amazon_fee"),
-                shipping_fee=row.get("shipping_fee"),
-                total_amount=row.get("total_amount"),
-                created_at=datetime.utcnow()
-            )
-            db.session.add(new_entry)
-
-        db.session.commit()
-    print("✅ Settlement data saved to database.")
\ No newline at end of file
+        chunk = {}
+        for line_number, row in enumerate(reader, start=1):
+            record = normalize_settlement(selling_partner_id, row)
+            chunk[settlement_buffer_key(selling_partner_id, record["settlement_id"], line_number)] = record
+            if len(chunk) >= DB_CHUNK_SIZE:
+                buffer_settlements(redis_client, chunk)
+                queued += len(chunk)
+                chunk = {}
+
+        if chunk:
+            buffer_settlements(redis_client, chunk)
+            queued += len(chunk)
+
+    print(f"✅ {queued} settlement rows queued for database write.")
+    return queued
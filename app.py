@@ -1,18 +1,31 @@
 import os
+import hmac
 import uuid
 import requests
 import redis
-import json
+import click
 from flask import Flask, session, redirect, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from dotenv import load_dotenv
 from datetime import timedelta, datetime  # Instead of `import datetime`
+from concurrent.futures import ThreadPoolExecutor
 from flask_cors import CORS
-from models import db, AmazonOAuthTokens, AmazonOrders, AmazonSettlementData  # Use the correct class name
+from models import db, AmazonOAuthTokens, AmazonOrders, AmazonSettlementData, AmazonSellerMarketplaces  # Use the correct class name
 import psycopg2
 from psycopg2.extras import execute_values
 from amazon_api import fetch_orders_from_amazon, request_settlement_report, download_report, get_report_status, process_settlement_report   # Adjust module name if needed
+from amazon_api import get_seller_marketplaces, region_for_marketplace, MARKETPLACE_REGIONS, SPAPIError
+from serializers import dumps, json_response, raw_json_response, null_zero_amounts, fetch_orders_rows, fetch_order_summary_rows
+from write_buffer import buffer_orders, flush, pending_counts, start_flush_worker, WriteBufferFull
+from snapshots import get_snapshot
+from http_cache import cached_json_response, negotiate_encoding, compress, orders_cache_key, watermark_key, ALL_ORDERS_SCOPE, ORDERS_CACHE_TTL, MIN_COMPRESS_SIZE
+from query_profiler import init_query_profiler, recent_profiles
+from archive import archive_table, merge_with_archive, read_archive, rearrived_keys
+from rate_limiter import init_rate_limiter, quota_metrics, QuotaUnavailable, MAX_QUOTA_WAIT
+from segmentation import ingest_csv, compute_rfm, compute_cohorts, cached_result, DATASET_FILES, DEFAULT_DATASET
+from bulk_import import save_upload, create_job, get_job, run_import
+from notifications import enqueue_notification, process_notification_batch, NOTIFICATION_BATCH_SIZE
 
 # Load environment variables
 load_dotenv()
@@ -31,11 +44,20 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 # Redis Configuration
 REDIS_URL = os.getenv("REDIS_URL")
 redis_client = redis.StrictRedis.from_url(REDIS_URL, decode_responses=True)
+redis_binary_client = redis.StrictRedis.from_url(REDIS_URL)  # For compressed payloads
+
+# SP-API quotas are shared by every worker and machine through Redis
+init_rate_limiter(redis_client)
 
 # Initialize database
 db.init_app(app)
 migrate = Migrate(app, db)
 
+# Query profiling (per-request counts/timings, N+1 and slow query detection), off unless enabled
+QUERY_PROFILER_ENABLED = os.getenv("QUERY_PROFILER") == "1"
+if QUERY_PROFILER_ENABLED:
+    init_query_profiler(app, explain_slow=os.getenv("QUERY_PROFILER_EXPLAIN") == "1")
+
 # Amazon OAuth Variables
 LWA_APP_ID = os.getenv("LWA_APP_ID")
 LWA_CLIENT_SECRET = os.getenv("LWA_CLIENT_SECRET")
@@ -45,6 +67,9 @@ TOKEN_URL = os.getenv("TOKEN_URL")
 SP_API_BASE_URL = os.getenv("SP_API_BASE_URL")
 APP_ID = os.getenv("APP_ID")
 
+# Shared secret the notification forwarder sends in X-Notifications-Secret, endpoints are closed without it
+NOTIFICATIONS_SECRET = os.getenv("NOTIFICATIONS_SECRET")
+
 # Ensure database connection
 try:
     conn = psycopg2.connect(DATABASE_URL)
@@ -54,6 +79,21 @@ except Exception as e:
     print(f"❌ Database connection failed: {e}")
 
 one_year_ago = datetime.utcnow() - timedelta(days=365)
+ORDER_FETCH_LOCK_TTL = 60  # comfortably longer than the write buffer's flush window
+ARCHIVED_SUMMARY_COLUMNS = ["marketplace_id", "total_amount", "order_status", "purchase_date"]
+
+# Multi-seller lookups and the background syncs they trigger
+MAX_BATCH_SELLERS = 100
+SYNC_SCHEDULE_TTL = 900   # a seller is synced in the background at most this often
+SYNC_LOCK_TTL = 900       # upper bound for one running background sync (quota waits included)
+sync_executor = ThreadPoolExecutor(max_workers=2)
+
+# CSV imports run one at a time per machine so memory stays bounded on the 1 GB VM
+import_executor = ThreadPoolExecutor(max_workers=1)
+
+# Background flusher for the write-behind buffer, one per worker process (flushes are lock-coordinated)
+if os.getenv("WRITE_BUFFER_WORKER", "1") == "1":
+    start_flush_worker(app, redis_client)
 
 def refresh_access_token(selling_partner_id):
     token_entry = AmazonOAuthTokens.query.filter_by(selling_partner_id=selling_partner_id).first()
@@ -158,38 +198,10 @@ def save_oauth_tokens(selling_partner_id, access_token, refresh_token, expires_i
             conn.close()
 
 def store_orders_in_db(selling_partner_id, orders):
-    """Save only necessary Amazon order fields into PostgreSQL."""
-    for order in orders:
-        order_id = order.get("AmazonOrderId")  # ✅ Amazon's order ID
-        marketplace_id = order.get("MarketplaceId")
-        amazon_order_id = order.get("AmazonOrderId")  # ✅ Ensure this field is stored
-        number_of_items_shipped = order.get("NumberOfItemsShipped", 0)
-        order_status = order.get("OrderStatus", "UNKNOWN")
-        total_amount = float(order.get("OrderTotal", {}).get("Amount", 0) or 0)
-        currency = order.get("OrderTotal", {}).get("CurrencyCode")
-        purchase_date = order.get("PurchaseDate")
-
-        # Check if the order already exists
-        existing_order = AmazonOrders.query.filter_by(order_id=order_id).first()
-
-        if not existing_order:  # ✅ Avoid duplicate entries
-            new_order = AmazonOrders(
-                order_id=order_id,
-                amazon_order_id=amazon_order_id,  # ✅ Ensure this is stored
-                marketplace_id=marketplace_id,
-                selling_partner_id=selling_partner_id,
-                number_of_items_shipped=number_of_items_shipped,
-                order_status=order_status,
-                total_amount=total_amount,
-                currency=currency,
-                purchase_date=datetime.strptime(purchase_date, "%Y-%m-%dT%H:%M:%SZ"),
-                created_at=datetime.utcnow()
-            )
-
-            db.session.add(new_order)
-
-    db.session.commit()
-    print(f"✅ {len(orders)} orders saved to database.")
+    """Queue Amazon orders on the write-behind buffer, the flush worker upserts them into PostgreSQL."""
+    records = buffer_orders(redis_client, selling_partner_id, orders)
+    print(f"✅ {len(records)} orders queued for database write.")
+    return records
 
 @app.route('/start-oauth')
 def start_oauth():
@@ -242,56 +254,184 @@ def get_orders():
     if not selling_partner_id:
         return jsonify({"error": "Missing selling_partner_id"}), 400
 
-    # ✅ Step 1: Check Redis Cache First (Optimize Performance)
-    cache_key = f"orders:{selling_partner_id}"
-    cached_orders = redis_client.get(cache_key)
-    if cached_orders:
-        return jsonify(json.loads(cached_orders))
-
-    # ✅ Step 2: Fetch Orders from Database First
+    # ✅ Step 1: Serve from Redis or the Database (304 / compressed bytes when possible)
     one_year_ago = datetime.utcnow() - timedelta(days=365)
-    orders = AmazonOrders.query.filter(
-        AmazonOrders.selling_partner_id == selling_partner_id,
-        AmazonOrders.purchase_date >= one_year_ago
-    ).all()
 
-    if orders:
-        orders_data = [order.to_dict() for order in orders]
-        redis_client.setex(cache_key, 900, json.dumps(orders_data))
-        return jsonify(orders_data)
+    def build_payload():
+        orders_data = fetch_orders_rows(
+            AmazonOrders.selling_partner_id == selling_partner_id,
+            AmazonOrders.purchase_date >= one_year_ago
+        )
+        # Ranges older than the hot window are read from the columnar archive
+        orders_data = merge_with_archive(orders_data, "amazon_orders", since=one_year_ago,
+                                         selling_partner_id=selling_partner_id)
+        return dumps(null_zero_amounts(orders_data)) if orders_data else None
+
+    response = cached_json_response(request, redis_client, redis_binary_client, selling_partner_id, build_payload)
+    if response is not None:
+        return response
 
     # ✅ Step 3: If No Orders in DB, Fetch from Amazon API
+    # Fetched orders only reach the DB on the next flush, the lock stops repeat SP-API calls meanwhile
+    sync_lock_key = f"sync:lock:{selling_partner_id}"
+    if not redis_client.set(sync_lock_key, 1, nx=True, ex=ORDER_FETCH_LOCK_TTL):
+        return jsonify({"message": "Orders sync in progress, retry shortly"}), 202, {"Retry-After": "5"}
+
     access_token = get_stored_tokens(selling_partner_id)
     if not access_token:
+        redis_client.delete(sync_lock_key)
         return jsonify({"error": "No valid access token found"}), 400
 
     created_after = one_year_ago.isoformat()
-    fetched_orders = fetch_orders_from_amazon(selling_partner_id, access_token, created_after)
+    try:
+        fetched_orders = fetch_orders_from_amazon(selling_partner_id, access_token, created_after)
+    except QuotaUnavailable as e:
+        redis_client.delete(sync_lock_key)
+        return jsonify({"error": "SP-API quota exhausted, retry later"}), 429, {"Retry-After": str(e.retry_after)}
+    except SPAPIError as e:
+        redis_client.delete(sync_lock_key)
+        return jsonify({"error": "Failed to fetch orders from Amazon", "details": str(e)}), 502
 
     if not fetched_orders:
+        redis_client.delete(sync_lock_key)
         return jsonify({"error": "No orders found in Amazon API"}), 404
 
-    # ✅ Step 4: Save Orders to Database
-    store_orders_in_db(selling_partner_id, fetched_orders)
-
-    # ✅ Step 5: Return the Newly Fetched Orders
-    orders_data = [order.to_dict() for order in fetched_orders]
-    redis_client.setex(cache_key, 900, json.dumps(orders_data))  # Cache results
-    return jsonify(orders_data), 200
+    # ✅ Step 4: Queue Orders for the Database (written behind by the flush worker)
+    try:
+        orders_data = store_orders_in_db(selling_partner_id, fetched_orders)
+    except WriteBufferFull:
+        redis_client.delete(sync_lock_key)
+        return jsonify({"error": "Order ingestion is busy, retry shortly"}), 503, {"Retry-After": "5"}
+
+    # ✅ Step 5: Return the Newly Fetched Orders (not cached until they are in the DB)
+    return json_response(null_zero_amounts(orders_data), 200)
+
+def sync_seller_orders(selling_partner_id):
+    """Background job: pull a seller's last year of orders from Amazon into the write buffer."""
+    # Same lock as /get-orders' fetch, held while running and, once orders are buffered, until they are flushed
+    sync_lock_key = f"sync:lock:{selling_partner_id}"
+    if not redis_client.set(sync_lock_key, 1, nx=True, ex=SYNC_LOCK_TTL):
+        return
+
+    buffered = False
+    with app.app_context():
+        try:
+            access_token = get_stored_tokens(selling_partner_id)
+            if not access_token:
+                print(f"❌ No valid access token for background sync of {selling_partner_id}")
+                return
+
+            created_after = (datetime.utcnow() - timedelta(days=365)).isoformat()
+            # Nobody is waiting on a background sync, it may queue for quota much longer than a request
+            fetched_orders = fetch_orders_from_amazon(selling_partner_id, access_token, created_after,
+                                                      max_wait=MAX_QUOTA_WAIT)
+            if fetched_orders:
+                store_orders_in_db(selling_partner_id, fetched_orders)
+                buffered = True
+        except Exception as e:
+            print(f"❌ Background sync failed for {selling_partner_id}: {e}")
+        finally:
+            db.session.remove()
+            if buffered:
+                redis_client.expire(sync_lock_key, ORDER_FETCH_LOCK_TTL)
+            else:
+                redis_client.delete(sync_lock_key)
+
+def schedule_order_sync(selling_partner_id):
+    """Queue a background sync unless one was scheduled recently by any worker."""
+    if redis_client.set(f"sync:scheduled:{selling_partner_id}", 1, nx=True, ex=SYNC_SCHEDULE_TTL):
+        sync_executor.submit(sync_seller_orders, selling_partner_id)
+        return True
+    return False
+
+@app.route("/get-orders/batch", methods=["POST"])
+def get_orders_batch():
+    """Orders for many sellers at once: one Redis MGET, one IN (...) query, background syncs for the rest."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    selling_partner_ids = data.get("selling_partner_ids")
+    if not selling_partner_ids:
+        return jsonify({"error": "Missing selling_partner_ids"}), 400
+    if not isinstance(selling_partner_ids, list) \
+            or not all(isinstance(seller, str) and seller for seller in selling_partner_ids):
+        return jsonify({"error": "selling_partner_ids must be a list of non-empty strings"}), 400
+    selling_partner_ids = list(dict.fromkeys(selling_partner_ids))
+    if len(selling_partner_ids) > MAX_BATCH_SELLERS:
+        return jsonify({"error": f"At most {MAX_BATCH_SELLERS} sellers per batch"}), 400
+
+    # ✅ Step 1: All cache lookups in a single round trip
+    cached = redis_binary_client.mget([orders_cache_key(seller) for seller in selling_partner_ids])
+    payloads = {seller: payload for seller, payload in zip(selling_partner_ids, cached) if payload is not None}
+    misses = [seller for seller in selling_partner_ids if seller not in payloads]
+
+    # ✅ Step 2: All cache misses in a single query, grouped by seller
+    if misses:
+        watermarks = redis_client.mget([watermark_key(seller) for seller in misses])
+        one_year_ago = datetime.utcnow() - timedelta(days=365)
+        orders_by_seller = {seller: [] for seller in misses}
+        for order in fetch_orders_rows(
+            AmazonOrders.selling_partner_id.in_(misses),
+            AmazonOrders.purchase_date >= one_year_ago
+        ):
+            orders_by_seller[order["selling_partner_id"]].append(order)
+
+        # Sellers invalidated by a flush while we were querying are served but not cached
+        unchanged = {
+            seller for seller, before, after
+            in zip(misses, watermarks, redis_client.mget([watermark_key(seller) for seller in misses]))
+            if before == after
+        }
+        pipe = redis_binary_client.pipeline(transaction=False)
+        for seller, orders_data in orders_by_seller.items():
+            orders_data = merge_with_archive(orders_data, "amazon_orders", since=one_year_ago,
+                                             selling_partner_id=seller)
+            if orders_data:
+                payloads[seller] = dumps(null_zero_amounts(orders_data))
+                if seller in unchanged:
+                    pipe.setex(orders_cache_key(seller), ORDERS_CACHE_TTL, payloads[seller])
+        pipe.execute()
+
+    # ✅ Step 3: Sellers with no data at all get a background sync instead of blocking this request
+    no_data = [seller for seller in selling_partner_ids if seller not in payloads]
+    sync_scheduled = [seller for seller in no_data if schedule_order_sync(seller)]
+
+    # Cached payloads are already JSON, splice them in rather than decoding and re-encoding
+    body = b"".join([
+        b'{"orders":{',
+        b",".join(dumps(seller) + b":" + payloads[seller] for seller in selling_partner_ids if seller in payloads),
+        b'},"pending":', dumps(no_data),
+        b',"sync_scheduled":', dumps(sync_scheduled),
+        b"}",
+    ])
+
+    encoding = negotiate_encoding(request)
+    if encoding and len(body) >= MIN_COMPRESS_SIZE:
+        response = raw_json_response(compress(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = raw_json_response(body)
+    response.vary.add("Accept-Encoding")
+    return response
 
 @app.route("/api/orders", methods=["GET"])
 def get_amazon_orders():
-    orders = AmazonOrders.query.all()
-    orders_data = [
-        {
-            "marketplace_id": order.marketplace_id,
-            "total_amount": float(order.total_amount) if order.total_amount else 0,
-            "order_status": order.order_status,
-            "purchase_date": order.purchase_date.strftime('%Y-%m-%d') if order.purchase_date else None,
-        }
-        for order in orders
-    ]
-    return jsonify(orders_data)
+    def build_payload():
+        # Orders re-synced after archival are in the hot table too, serve that copy only
+        rearrived = rearrived_keys("amazon_orders")
+        archived_orders = [
+            {
+                "marketplace_id": order["marketplace_id"],
+                "total_amount": order["total_amount"] or 0,
+                "order_status": order["order_status"],
+                "purchase_date": order["purchase_date"].date() if order["purchase_date"] else None,
+            }
+            for order in read_archive("amazon_orders", columns=ARCHIVED_SUMMARY_COLUMNS)
+            if order["order_id"] not in rearrived
+        ]
+        return dumps(archived_orders + fetch_order_summary_rows())
+
+    return cached_json_response(request, redis_client, redis_binary_client, ALL_ORDERS_SCOPE, build_payload)
 
 @app.route("/fetch-settlement-data", methods=["GET"])
 def fetch_settlement_data():
@@ -302,20 +442,242 @@ def fetch_settlement_data():
     if not access_token:
         return jsonify({"error": "No valid access token found"}), 400
 
-    # Request the settlement report
-    report_id = request_settlement_report(access_token, selling_partner_id)
-    if not report_id:
-        return jsonify({"error": "Failed to request report"}), 500
+    # Settlement reports are per region, use the requested one or the seller's first marketplace's region
+    marketplace_ids = get_seller_marketplaces(selling_partner_id)
+    region = request.args.get("region") or region_for_marketplace(marketplace_ids[0])
+    region_marketplace_ids = [m for m in marketplace_ids if region_for_marketplace(m) == region]
+    if not region_marketplace_ids:
+        return jsonify({"error": f"Seller has no marketplaces in region {region}"}), 400
 
-    # Wait until the report is processed (should ideally use async processing)
-    processing_status, document_id = get_report_status(access_token, report_id)
-    if processing_status != "DONE" or not document_id:
-        return jsonify({"error": "Report still processing"}), 202
+    try:
+        # Request the settlement report
+        report_id = request_settlement_report(access_token, selling_partner_id, region_marketplace_ids)
+        if not report_id:
+            return jsonify({"error": "Failed to request report"}), 500
+
+        # Wait until the report is processed (should ideally use async processing)
+        processing_status, document_id = get_report_status(access_token, report_id, region, selling_partner_id)
+        if processing_status != "DONE" or not document_id:
+            return jsonify({"error": "Report still processing"}), 202
+
+        # Download and process the report
+        file_path = download_report(access_token, document_id, region, selling_partner_id)
+        if not file_path:
+            return jsonify({"error": "Failed to download report"}), 500
+    except QuotaUnavailable as e:
+        return jsonify({"error": "SP-API quota exhausted, retry later"}), 429, {"Retry-After": str(e.retry_after)}
 
-    # Download and process the report
-    file_path = download_report(access_token, document_id)
+    try:
+        queued = process_settlement_report(file_path, selling_partner_id, redis_client)
+    except WriteBufferFull:
+        return jsonify({"error": "Settlement ingestion is busy, retry shortly"}), 503, {"Retry-After": "5"}
+    return jsonify({"message": "Settlement data fetched and queued for storage!", "rows": queued}), 200
+
+@app.route("/seller-marketplaces", methods=["GET"])
+def list_seller_marketplaces():
+    """List the marketplaces orders are fetched from for a seller."""
+    selling_partner_id = request.args.get("selling_partner_id")
+    if not selling_partner_id:
+        return jsonify({"error": "Missing selling_partner_id"}), 400
+
+    marketplace_ids = get_seller_marketplaces(selling_partner_id)
+    return json_response([
+        {"marketplace_id": m, "region": region_for_marketplace(m)} for m in marketplace_ids
+    ], 200)
+
+@app.route("/seller-marketplaces", methods=["PUT"])
+def set_seller_marketplaces():
+    """Replace the set of marketplaces a seller's orders are fetched from."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    selling_partner_id = data.get("selling_partner_id")
+    marketplace_ids = data.get("marketplace_ids")
+    if not selling_partner_id or not marketplace_ids:
+        return jsonify({"error": "Missing selling_partner_id or marketplace_ids"}), 400
+    if not isinstance(selling_partner_id, str) or not isinstance(marketplace_ids, list) \
+            or not all(isinstance(m, str) for m in marketplace_ids):
+        return jsonify({"error": "selling_partner_id must be a string and marketplace_ids a list of strings"}), 400
+
+    unknown = [m for m in marketplace_ids if m not in MARKETPLACE_REGIONS]
+    if unknown:
+        return jsonify({"error": "Unknown marketplace_ids", "details": unknown}), 400
+
+    if not AmazonOAuthTokens.query.filter_by(selling_partner_id=selling_partner_id).first():
+        return jsonify({"error": "Unknown selling_partner_id"}), 404
+
+    try:
+        AmazonSellerMarketplaces.query.filter_by(selling_partner_id=selling_partner_id).delete()
+        for marketplace_id in dict.fromkeys(marketplace_ids):
+            db.session.add(AmazonSellerMarketplaces(
+                selling_partner_id=selling_partner_id,
+                marketplace_id=marketplace_id,
+                region=MARKETPLACE_REGIONS[marketplace_id]
+            ))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Failed to save marketplaces for {selling_partner_id}: {e}")
+        return jsonify({"error": "Failed to save marketplaces", "details": str(e)}), 500
+
+    rows = AmazonSellerMarketplaces.query.filter_by(selling_partner_id=selling_partner_id).all()
+    return json_response([row.to_dict() for row in rows], 200)
+
+def notifications_authorized():
+    """Notification endpoints rewrite orders, callers must send the shared NOTIFICATIONS_SECRET."""
+    provided = request.headers.get("X-Notifications-Secret", "")
+    return bool(NOTIFICATIONS_SECRET) and hmac.compare_digest(provided, NOTIFICATIONS_SECRET)
+
+@app.route("/notifications/order-change", methods=["POST"])
+def receive_order_change():
+    """Accept an SP-API ORDER_CHANGE notification (SQS message or raw payload) and queue it."""
+    if not notifications_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    message = request.get_json(silent=True)
+    if not message:
+        return jsonify({"error": "Missing notification payload"}), 400
+
+    try:
+        queue_length = enqueue_notification(redis_client, message)
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": "Invalid notification payload", "details": str(e)}), 400
+
+    # ✅ Apply in micro-batches instead of one DB round trip per notification
+    if queue_length >= NOTIFICATION_BATCH_SIZE:
+        result = process_notification_batch(redis_client)
+        return json_response({"message": "Notification batch applied", **result}, 200)
+
+    return json_response({"message": "Notification queued", "queued": queue_length}, 202)
+
+@app.route("/notifications/drain", methods=["POST"])
+def drain_order_changes():
+    """Flush queued order notifications now, the flush worker also applies them once they are a few seconds old."""
+    if not notifications_authorized():
+        return jsonify({"error": "Unauthorized"}), 401
+
+    batch_size = request.args.get("batch_size", NOTIFICATION_BATCH_SIZE, type=int)
+    if batch_size < 1:
+        return jsonify({"error": "batch_size must be at least 1"}), 400
+    result = process_notification_batch(redis_client, batch_size)
+    return json_response(result, 200)
+
+@app.route("/write-buffer", methods=["GET"])
+def write_buffer_status():
+    """Show how many records are waiting to be written to the database."""
+    return json_response(pending_counts(redis_client), 200)
+
+@app.route("/write-buffer/flush", methods=["POST"])
+def flush_write_buffer():
+    """Force a synchronous flush of the write-behind buffer."""
+    flushed = flush(redis_client)
+    if flushed is None:
+        return jsonify({"message": "Flush already in progress"}), 202
+    return json_response(flushed, 200)
+
+@app.route("/dashboard-snapshot", methods=["GET"])
+def dashboard_snapshot():
+    """Serve the precomputed dashboard document for a seller, 304 when the client copy is current."""
+    selling_partner_id = request.args.get("selling_partner_id")
+    if not selling_partner_id:
+        return jsonify({"error": "Missing selling_partner_id"}), 400
+
+    etag, body = get_snapshot(redis_client, selling_partner_id)
+
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = raw_json_response(body)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+@app.route("/sp-api/quota-metrics", methods=["GET"])
+def sp_api_quota_metrics():
+    """Queue-wait and throttling counters for each SP-API operation."""
+    return json_response(quota_metrics(), 200)
+
+def segmentation_response(kind, compute, variant=None):
+    dataset = request.args.get("dataset", DEFAULT_DATASET)
+    cache_kind = f"{kind}:{variant}" if variant else kind
+    version, payload = cached_result(redis_client, cache_kind, compute, dataset)
+
+    # The dataset version is the validator, it changes exactly when new orders are ingested
+    # (plus the variant, e.g. RFM recency moves every day without new orders)
+    etag = f"{dataset}-{version}-{variant}" if variant else f"{dataset}-{version}"
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = raw_json_response(payload)
+    response.set_etag(etag)
+    return response
+
+@app.route("/segments/ingest", methods=["POST"])
+def ingest_segmentation_dataset():
+    """Fold a bundled retail dataset into the incremental RFM/cohort state."""
+    dataset = request.args.get("dataset", DEFAULT_DATASET)
+    file_path = DATASET_FILES.get(dataset)
     if not file_path:
-        return jsonify({"error": "Failed to download report"}), 500
+        return jsonify({"error": f"Unknown dataset {dataset}"}), 400
+
+    try:
+        version = ingest_csv(redis_client, file_path, dataset)
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "30"}
+    return json_response({"dataset": dataset, "version": version}, 200)
+
+@app.route("/segments/rfm", methods=["GET"])
+def rfm_segments():
+    """Per-customer RFM scores and segment counts, recency as of today (UTC)."""
+    as_of = datetime.utcnow().date().isoformat()
+    return segmentation_response(
+        "rfm", lambda client, dataset: compute_rfm(client, dataset, as_of), variant=as_of
+    )
+
+@app.route("/segments/cohorts", methods=["GET"])
+def cohort_retention():
+    """Monthly cohort retention matrix."""
+    return segmentation_response("cohorts", compute_cohorts)
 
-    process_settlement_report(file_path, selling_partner_id)
-    return jsonify({"message": "Settlement data fetched and stored successfully!"}), 200
\ No newline at end of file
+@app.route("/imports/orders", methods=["POST"])
+def import_orders_csv():
+    """Upload an order export (multipart "file" or raw text/csv body) and import it in the background."""
+    selling_partner_id = request.args.get("selling_partner_id")
+    dataset = request.args.get("dataset")  # Optional, also folds the rows into that segmentation dataset
+
+    upload = request.files.get("file") if request.mimetype == "multipart/form-data" else None
+    stream = upload.stream if upload else request.stream
+    job_id, path = save_upload(stream)
+
+    if os.path.getsize(path) == 0:
+        os.remove(path)
+        return jsonify({"error": "Empty upload"}), 400
+
+    create_job(redis_client, job_id, path, selling_partner_id, dataset)
+    import_executor.submit(run_import, redis_client, DATABASE_URL, job_id, path, selling_partner_id, dataset)
+    return json_response({"job_id": job_id, "status_url": f"/imports/{job_id}"}, 202)
+
+@app.route("/imports/<job_id>", methods=["GET"])
+def import_status(job_id):
+    """Progress of a CSV import job."""
+    job = get_job(redis_client, job_id)
+    if not job:
+        return jsonify({"error": "Unknown import job"}), 404
+    return json_response(job, 200)
+
+@app.route("/debug/queries", methods=["GET"])
+def debug_queries():
+    """Recent per-request query profiles and slow statements (with plans when EXPLAIN is enabled)."""
+    if not QUERY_PROFILER_ENABLED:
+        return jsonify({"error": "Query profiler is disabled, set QUERY_PROFILER=1"}), 404
+    return json_response(recent_profiles(), 200)
+
+@app.cli.command("archive")
+@click.option("--table", type=click.Choice(["amazon_orders", "amazon_settlement_data"]), multiple=True,
+              help="Table to archive, defaults to both.")
+@click.option("--older-than-days", type=int, default=None, help="Hot window to keep in Postgres.")
+def archive_command(table, older_than_days):
+    """Move rows older than the hot window to partitioned columnar files under ARCHIVE_DIR."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days) if older_than_days else None
+    for table_name in table or ("amazon_orders", "amazon_settlement_data"):
+        archive_table(table_name, cutoff)
@@ -0,0 +1,261 @@
+import os
+import glob
+import json
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from models import db, AmazonOrders, AmazonSettlementData
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Archival is optional, the hot tables keep working without pyarrow
+    pa = None
+    pq = None
+
+# Must point at a persistent volume, the app filesystem is ephemeral. A Fly volume is attached to one
+# machine only, so archived rows are only readable on that machine: run the app on a single machine
+# (or on shared storage) once anything has been archived.
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+ARCHIVE_HOT_DAYS = int(os.getenv("ARCHIVE_HOT_DAYS", "365"))  # rows older than this leave Postgres
+ARCHIVE_CHUNK_SIZE = 5000
+ARCHIVE_COMPRESSION = "zstd"
+
+
+def _tables():
+    """Archivable tables with their time column, row identity and on-disk columnar schema."""
+    return {
+        "amazon_orders": {
+            "model": AmazonOrders,
+            "time_column": "purchase_date",
+            # A sync can re-insert an archived order under a new id, order_id is what identifies it
+            "row_key": "order_id",
+            "key_columns": ("order_id",),
+            "schema": pa.schema([
+                ("id", pa.int64()),
+                ("order_id", pa.string()),
+                ("amazon_order_id", pa.string()),
+                ("selling_partner_id", pa.string()),
+                ("marketplace_id", pa.string()),
+                ("number_of_items_shipped", pa.int32()),
+                ("order_status", pa.string()),
+                ("total_amount", pa.float64()),  # Unscaled Numeric, cast to float when archiving
+                ("currency", pa.string()),
+                ("purchase_date", pa.timestamp("us")),
+                ("created_at", pa.timestamp("us")),
+            ]),
+        },
+        "amazon_settlement_data": {
+            "model": AmazonSettlementData,
+            "time_column": "date_time",
+            "row_key": "id",
+            # Settlement lines have no natural id, a re-processed report re-inserts identical lines
+            "key_columns": ("settlement_id", "order_id", "type", "date_time",
+                            "amount", "amazon_fee", "shipping_fee", "total_amount"),
+            "schema": pa.schema([
+                ("id", pa.int64()),
+                ("selling_partner_id", pa.string()),
+                ("settlement_id", pa.string()),
+                ("date_time", pa.timestamp("us")),
+                ("order_id", pa.string()),
+                ("type", pa.string()),
+                ("amount", pa.decimal128(10, 2)),
+                ("amazon_fee", pa.decimal128(10, 2)),
+                ("shipping_fee", pa.decimal128(10, 2)),
+                ("total_amount", pa.decimal128(10, 2)),
+                ("created_at", pa.timestamp("us")),
+            ]),
+        },
+    }
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("pyarrow is required for archival, install it with `pip install pyarrow`")
+
+
+def _require_archive_dir():
+    if not ARCHIVE_DIR:
+        raise RuntimeError("Set ARCHIVE_DIR to a persistent volume before archiving, rows are deleted from Postgres")
+
+
+def _partition_dir(table_name, selling_partner_id, month):
+    return os.path.join(ARCHIVE_DIR, table_name, f"seller={selling_partner_id}", f"month={month}")
+
+
+def _manifest_path(table_name):
+    return os.path.join(ARCHIVE_DIR, table_name, "_manifest.json")
+
+
+def archived_before(table_name):
+    """Everything older than this timestamp lives on disk instead of in Postgres (None = nothing archived)."""
+    if not ARCHIVE_DIR:
+        return None
+    try:
+        with open(_manifest_path(table_name)) as f:
+            return datetime.fromisoformat(json.load(f)["archived_before"])
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+
+
+def _write_manifest(table_name, cutoff):
+    previous = archived_before(table_name)
+    if previous and previous >= cutoff:
+        return
+    os.makedirs(os.path.dirname(_manifest_path(table_name)), exist_ok=True)
+    tmp_path = _manifest_path(table_name) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"archived_before": cutoff.isoformat()}, f)
+    os.replace(tmp_path, _manifest_path(table_name))
+
+
+def _archived_keys(directory, key_columns):
+    """Count the row keys already on disk in one partition."""
+    counts = Counter()
+    for path in glob.glob(os.path.join(directory, "*.parquet")):
+        table = pq.read_table(path, columns=list(key_columns), memory_map=True)
+        counts.update(tuple(row[name] for name in key_columns) for row in table.to_pylist())
+    return counts
+
+
+def _flush_partition(table_name, config, partition, rows):
+    """Write one partition's new rows to a new file, then delete every given row from Postgres."""
+    if not rows:
+        return 0
+
+    model, schema, key_columns = config["model"], config["schema"], config["key_columns"]
+    selling_partner_id, month = partition
+    directory = _partition_dir(table_name, selling_partner_id, month)
+    os.makedirs(directory, exist_ok=True)
+
+    # Rows re-inserted after an earlier archive run are already on disk, only delete them.
+    # Counted, so identical lines that really are distinct keep their multiplicity.
+    on_disk = _archived_keys(directory, key_columns)
+    new_rows = []
+    for row in rows:
+        key = tuple(row[name] for name in key_columns)
+        if on_disk[key] > 0:
+            on_disk[key] -= 1
+        else:
+            new_rows.append(row)
+
+    if new_rows:
+        columns = {name: [row[name] for row in new_rows] for name in schema.names}
+        table = pa.Table.from_pydict(columns, schema=schema)
+
+        final_path = os.path.join(directory, f"part-{uuid.uuid4().hex}.parquet")
+        tmp_path = final_path + ".tmp"
+        pq.write_table(table, tmp_path, compression=ARCHIVE_COMPRESSION)
+        os.replace(tmp_path, final_path)  # Readers never see a half-written file
+
+    # A crash right here leaves the rows in both places, the next run finds them on disk and only deletes
+    ids = [row["id"] for row in rows]
+    db.session.execute(db.delete(model).where(model.id.in_(ids)))
+    db.session.commit()
+    return len(new_rows)
+
+
+def archive_table(table_name, cutoff=None, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Stream rows older than cutoff out to partitioned columnar files and remove them from Postgres."""
+    _require_pyarrow()
+    _require_archive_dir()
+    config = _tables()[table_name]
+    model, schema = config["model"], config["schema"]
+    time_column = getattr(model, config["time_column"])
+    cutoff = cutoff or datetime.utcnow() - timedelta(days=ARCHIVE_HOT_DAYS)
+
+    # Unscaled Numeric columns come back as Decimal, which Arrow won't put in a float64 column
+    columns = [
+        db.cast(getattr(model, name), db.Float).label(name)
+        if pa.types.is_floating(schema.field(name).type) else getattr(model, name)
+        for name in schema.names
+    ]
+    query = (
+        db.select(*columns)
+        .where(time_column < cutoff)
+        .order_by(model.selling_partner_id, time_column, model.id)
+        .execution_options(stream_results=True, yield_per=chunk_size)
+    )
+
+    # Rows arrive ordered by seller and time, so only one partition is buffered at a time
+    archived = 0
+    partition, rows = None, []
+    with db.engine.connect() as conn:
+        result = conn.execute(query)
+        keys = list(result.keys())
+        for row in result:
+            record = dict(zip(keys, row))
+            row_partition = (record["selling_partner_id"], record[config["time_column"]].strftime("%Y-%m"))
+            if row_partition != partition or len(rows) >= chunk_size:
+                archived += _flush_partition(table_name, config, partition, rows)
+                partition, rows = row_partition, []
+            rows.append(record)
+        archived += _flush_partition(table_name, config, partition, rows)
+
+    _write_manifest(table_name, cutoff)
+    print(f"✅ Archived {archived} rows from {table_name} older than {cutoff:%Y-%m-%d}.")
+    return archived
+
+
+def _months_between(start, end):
+    month = datetime(start.year, start.month, 1)
+    while month <= end:
+        yield month.strftime("%Y-%m")
+        month = datetime(month.year + (month.month == 12), month.month % 12 + 1, 1)
+
+
+def read_archive(table_name, since=None, until=None, selling_partner_id=None, columns=None):
+    """Read archived rows in [since, until) as dicts, memory-mapping only the partitions in range."""
+    cutoff = archived_before(table_name)
+    if pa is None or cutoff is None or (since is not None and since >= cutoff):
+        return []
+
+    config = _tables()[table_name]
+    time_column = config["time_column"]
+    until = min(until or cutoff, cutoff)
+    seller_glob = f"seller={selling_partner_id}" if selling_partner_id else "seller=*"
+    month_globs = [f"month={month}" for month in _months_between(since, until)] if since else ["month=*"]
+
+    filters = [(time_column, "<", until)]
+    if since is not None:
+        filters.append((time_column, ">=", since))
+    row_key = config["row_key"]
+    if columns is not None and row_key not in columns:
+        columns = [row_key, *columns]
+
+    tables = []
+    for month_glob in month_globs:
+        for path in glob.glob(os.path.join(ARCHIVE_DIR, table_name, seller_glob, month_glob, "*.parquet")):
+            tables.append(pq.read_table(path, columns=columns, memory_map=True, filters=filters))
+
+    if not tables:
+        return []
+
+    # A crash between writing a file and deleting its rows can leave a row in two files, keep one copy
+    return list({row[row_key]: row for row in pa.concat_tables(tables).to_pylist()}.values())
+
+
+def rearrived_keys(table_name, selling_partner_id=None):
+    """Row keys of hot rows older than the archive cutoff, i.e. rows re-inserted after being archived."""
+    cutoff = archived_before(table_name)
+    if cutoff is None:
+        return set()
+    config = _tables()[table_name]
+    model = config["model"]
+    query = db.select(getattr(model, config["row_key"])).where(getattr(model, config["time_column"]) < cutoff)
+    if selling_partner_id:
+        query = query.where(model.selling_partner_id == selling_partner_id)
+    return set(db.session.execute(query).scalars())
+
+
+def merge_with_archive(hot_rows, table_name, since=None, selling_partner_id=None, columns=None):
+    """Transparently extend a hot-table result with archived rows when the range reaches past the hot window."""
+    archived_rows = read_archive(table_name, since, selling_partner_id=selling_partner_id, columns=columns)
+    if not archived_rows:
+        return hot_rows
+    # The hot copy of an order wins, it's the one a later sync updated
+    key = _tables()[table_name]["row_key"]
+    if hot_rows and key in hot_rows[0]:
+        hot_keys = {row[key] for row in hot_rows}
+        archived_rows = [row for row in archived_rows if row[key] not in hot_keys]
+    return archived_rows + hot_rows
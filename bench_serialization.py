@@ -0,0 +1,55 @@
+"""Micro-benchmark: ORM objects + to_dict + json.dumps vs column tuples + serializers.dumps.
+
+Runs without a database, rows are built in memory so only serialization is measured.
+Usage: python bench_serialization.py [rows]
+"""
+import sys
+import json
+import timeit
+from decimal import Decimal
+from datetime import datetime, timedelta
+from models import AmazonOrders
+from serializers import ORDER_COLUMNS, dumps, orjson
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+now = datetime.utcnow()
+
+
+def build_row(i):
+    return (
+        i,
+        f"701-{i:07d}-0000000",
+        f"701-{i:07d}-0000000",
+        "A3IW67JB0KIPK8",
+        "A1AM78C64UM0Y8",
+        i % 5,
+        "Shipped",
+        Decimal(f"{i % 1000}.99"),
+        "MXN",
+        now - timedelta(minutes=i),
+        now,
+    )
+
+
+keys = [column.key for column in ORDER_COLUMNS]
+tuples = [build_row(i) for i in range(ROWS)]
+orm_rows = [AmazonOrders(**dict(zip(keys, row))) for row in tuples]
+
+
+def current_path():
+    return json.dumps([order.to_dict() for order in orm_rows])
+
+
+def fast_path():
+    return dumps([dict(zip(keys, row)) for row in tuples])
+
+
+if __name__ == "__main__":
+    runs = 10
+    current = min(timeit.repeat(current_path, number=1, repeat=runs))
+    fast = min(timeit.repeat(fast_path, number=1, repeat=runs))
+    encoder = "orjson" if orjson is not None else "json (orjson not installed)"
+    print(f"🔍 {ROWS} rows, best of {runs}, encoder: {encoder}")
+    print(f"   to_dict + json.dumps:   {current * 1000:8.2f} ms")
+    print(f"   tuples + fast dumps:    {fast * 1000:8.2f} ms")
+    print(f"✅ Speedup: {current / fast:.1f}x")
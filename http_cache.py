@@ -0,0 +1,157 @@
+import gzip
+import time
+import hashlib
+from datetime import datetime, timezone
+from flask import Response
+from models import db, AmazonOrders
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip is always available
+    brotli = None
+
+ORDERS_CACHE_TTL = 900
+ALL_ORDERS_SCOPE = None         # scope used by /api/orders, which spans every seller, never a seller id
+MIN_COMPRESS_SIZE = 1024         # below this compression costs more than it saves
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def orders_cache_key(scope):
+    # Own prefix for the all-sellers payload, no seller id can collide with it
+    return "orders_all" if scope is ALL_ORDERS_SCOPE else f"orders:{scope}"
+
+
+def watermark_key(scope):
+    return f"{orders_cache_key(scope)}:watermark"
+
+
+def _encoded_cache_keys(scope):
+    return [f"{orders_cache_key(scope)}:{encoding}" for encoding in ("gzip", "br")]
+
+
+def invalidate_orders_cache(redis_client, selling_partner_ids):
+    """Drop cached order payloads (plain and compressed) and bump the sync watermark for these sellers."""
+    selling_partner_ids = set(selling_partner_ids)
+    if not selling_partner_ids:
+        return
+
+    now = time.time()
+    pipe = redis_client.pipeline()
+    for scope in selling_partner_ids | {ALL_ORDERS_SCOPE}:
+        pipe.delete(orders_cache_key(scope), *_encoded_cache_keys(scope))
+        pipe.set(watermark_key(scope), now)
+    pipe.execute()
+
+
+def get_watermark(redis_client, scope):
+    """Return the last time the scope's orders changed, seeded from max(created_at) on first use."""
+    watermark = redis_client.get(watermark_key(scope))
+    if watermark is not None:
+        return float(watermark)
+
+    query = db.select(db.func.max(AmazonOrders.created_at))
+    if scope is not ALL_ORDERS_SCOPE:
+        query = query.where(AmazonOrders.selling_partner_id == scope)
+    latest_created_at = db.session.execute(query).scalar()
+
+    watermark = latest_created_at.replace(tzinfo=timezone.utc).timestamp() if latest_created_at else 0.0
+    # NX so a concurrent invalidation's newer watermark is never overwritten
+    redis_client.set(watermark_key(scope), watermark, nx=True)
+    return float(redis_client.get(watermark_key(scope)) or watermark)
+
+
+def etag_for(scope, last_modified):
+    return hashlib.sha1(f"{scope}:{last_modified}".encode("utf-8")).hexdigest()[:32]
+
+
+def _window_start():
+    """Midnight UTC today, /get-orders' rolling 365-day window moves at least this often."""
+    return datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+
+def negotiate_encoding(request):
+    """Pick the best content coding the client accepts, preferring brotli."""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(payload, encoding):
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    if encoding == "br":
+        return brotli.compress(payload, quality=BROTLI_QUALITY)
+    return gzip.compress(payload, compresslevel=GZIP_LEVEL)
+
+
+def not_modified(request, etag, last_modified):
+    """Check If-None-Match first, then If-Modified-Since, as RFC 9110 prescribes."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+
+def _with_validators(response, etag, last_modified):
+    # Weak, since the gzip/br/identity representations share one validator
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = datetime.fromtimestamp(int(last_modified), tz=timezone.utc)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def cached_json_response(request, redis_client, binary_redis_client, scope, build_payload,
+                         ttl=ORDERS_CACHE_TTL):
+    """Serve a scope's JSON payload with 304s, negotiated compression and cached compressed bytes.
+
+    build_payload() is only called on a full cache miss and must return serialized JSON bytes,
+    or None when there is nothing to cache.
+    """
+    watermark = get_watermark(redis_client, scope)
+    # Orders age out of the window without a sync, so validators also change once a day
+    last_modified = max(watermark, _window_start())
+    etag = etag_for(scope, last_modified)
+
+    if not_modified(request, etag, last_modified):
+        return _with_validators(Response(status=304), etag, last_modified)
+
+    cache_key = orders_cache_key(scope)
+    encoding = negotiate_encoding(request)
+
+    if encoding:
+        body = binary_redis_client.get(f"{cache_key}:{encoding}")
+        if body is not None:
+            response = Response(body, mimetype="application/json")
+            response.headers["Content-Encoding"] = encoding
+            return _with_validators(response, etag, last_modified)
+
+    cacheable = True
+    payload = binary_redis_client.get(cache_key)
+    if payload is None:
+        payload = build_payload()
+        if payload is None:
+            return None
+        # A flush that lands while we build invalidates before our write, never cache what it replaced
+        current = redis_client.get(watermark_key(scope))
+        cacheable = current is not None and float(current) == watermark
+        if cacheable:
+            binary_redis_client.setex(cache_key, ttl, payload)
+
+    if encoding is None or len(payload) < MIN_COMPRESS_SIZE:
+        return _with_validators(Response(payload, mimetype="application/json"), etag, last_modified)
+
+    body = compress(payload, encoding)
+    if cacheable:
+        # ✅ Keep the compressed copy next to the plain entry, with the same lifetime
+        remaining_ttl = binary_redis_client.ttl(cache_key)
+        binary_redis_client.setex(f"{cache_key}:{encoding}", remaining_ttl if remaining_ttl > 0 else ttl, body)
+    response = Response(body, mimetype="application/json")
+    response.headers["Content-Encoding"] = encoding
+    return _with_validators(response, etag, last_modified)
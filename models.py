@@ -83,3 +83,44 @@ class AmazonSettlementData(db.Model):
             "total_amount": float(self.total_amount) if self.total_amount else None,
             "created_at": self.created_at.strftime('%Y-%m-%d %H:%M:%S')
         }
+
+
+# MARKETPLACES EACH SELLER SELLS IN (drives the per-region order fan-out)
+class AmazonSellerMarketplaces(db.Model):
+    __tablename__ = 'amazon_seller_marketplaces'
+    __table_args__ = (db.UniqueConstraint("selling_partner_id", "marketplace_id"),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    selling_partner_id = db.Column(db.String, db.ForeignKey("amazon_oauth_tokens.selling_partner_id"), nullable=False, index=True)
+    marketplace_id = db.Column(db.String, nullable=False)
+    region = db.Column(db.String(2), nullable=False)  # na / eu / fe
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "selling_partner_id": self.selling_partner_id,
+            "marketplace_id": self.marketplace_id,
+            "region": self.region
+        }
+
+
+# OFFLINE ORDER LINES IMPORTED FROM MERCHANT CSV EXPORTS
+class RetailOrderLines(db.Model):
+    __tablename__ = 'retail_order_lines'
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    selling_partner_id = db.Column(db.String, nullable=True, index=True)
+    import_job_id = db.Column(db.String(36), nullable=False, index=True)
+    customer_id = db.Column(db.BigInteger, nullable=False)
+    order_date = db.Column(db.Date, nullable=False)
+    product_id = db.Column(db.Integer, nullable=True)
+    category_id = db.Column(db.Integer, nullable=True)
+    category_name = db.Column(db.String, nullable=True)
+    product_name = db.Column(db.String, nullable=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    price = db.Column(db.Numeric(10, 2), nullable=False)
+    payment_method = db.Column(db.String, nullable=True)
+    city = db.Column(db.String, nullable=True)
+    review_score = db.Column(db.Numeric(3, 1), nullable=True)
+    gender = db.Column(db.String(10), nullable=True)
+    age = db.Column(db.Integer, nullable=True)
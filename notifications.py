@@ -0,0 +1,240 @@
+import json
+import time
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError, DataError
+from models import db, AmazonOrders, AmazonOAuthTokens
+from snapshots import refresh_snapshots
+from http_cache import invalidate_orders_cache
+
+# Redis list standing in for the SQS queue that SP-API delivers notifications to
+NOTIFICATION_QUEUE_KEY = "sp_api:notifications:order_change"
+NOTIFICATION_DEAD_KEY = "sp_api:notifications:order_change:dead"
+NOTIFICATION_SINCE_KEY = "sp_api:notifications:order_change:since"
+NOTIFICATION_BATCH_SIZE = 50
+NOTIFICATION_MAX_AGE = 10   # seconds a queued change may wait before the flush loop applies it
+
+
+def parse_amazon_datetime(value):
+    """Parse SP-API ISO timestamps like 2025-02-16T20:21:28Z or 2025-02-16T20:21:28.123Z."""
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%dT%H:%M:%S.%fZ"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def unwrap_notification(message):
+    """Return the SP-API notification dict from a raw SQS message, SQS body or notification.
+
+    Raises ValueError for anything that isn't a notification object.
+    """
+    if isinstance(message, (str, bytes)):
+        message = json.loads(message)
+    if isinstance(message, dict) and "Body" in message:  # ✅ SQS envelope
+        body = message["Body"]
+        message = json.loads(body) if isinstance(body, (str, bytes)) else body
+    if not isinstance(message, dict) or not message.get("NotificationType"):
+        raise ValueError("Notification must be an object with a NotificationType")
+    return message
+
+
+def enqueue_notification(redis_client, message):
+    """Push one notification onto the local queue stand-in, returns the queue length."""
+    notification = unwrap_notification(message)
+    pipe = redis_client.pipeline()
+    pipe.rpush(NOTIFICATION_QUEUE_KEY, json.dumps(notification))
+    pipe.set(NOTIFICATION_SINCE_KEY, time.time(), nx=True)
+    queue_length, _ = pipe.execute()
+    return queue_length
+
+
+def pop_notification_batch(redis_client, batch_size=NOTIFICATION_BATCH_SIZE):
+    """Atomically pop up to batch_size queued notifications."""
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    pipe = redis_client.pipeline()
+    pipe.lrange(NOTIFICATION_QUEUE_KEY, 0, batch_size - 1)
+    pipe.ltrim(NOTIFICATION_QUEUE_KEY, batch_size, -1)
+    pipe.llen(NOTIFICATION_QUEUE_KEY)
+    raw_messages, _, remaining = pipe.execute()
+    if not remaining:
+        # A change queued right after this is still picked up, see notifications_due
+        redis_client.delete(NOTIFICATION_SINCE_KEY)
+    return [json.loads(raw) for raw in raw_messages]
+
+
+def notifications_due(redis_client):
+    """True when changes are queued and the oldest has waited NOTIFICATION_MAX_AGE seconds."""
+    pipe = redis_client.pipeline()
+    pipe.llen(NOTIFICATION_QUEUE_KEY)
+    pipe.get(NOTIFICATION_SINCE_KEY)
+    pending, since = pipe.execute()
+    if not pending:
+        return False
+    return since is None or time.time() - float(since) >= NOTIFICATION_MAX_AGE
+
+
+def extract_order_change(notification):
+    """Flatten an ORDER_CHANGE notification into the fields we keep in amazon_orders."""
+    if notification.get("NotificationType") != "ORDER_CHANGE":
+        return None
+
+    change = notification.get("Payload", {}).get("OrderChangeNotification", {})
+    order_id = change.get("AmazonOrderId")
+    selling_partner_id = change.get("SellerId")
+    if not order_id or not selling_partner_id:
+        return None
+
+    summary = change.get("Summary") or {}
+    order_total = summary.get("OrderTotal") or {}
+    return {
+        "order_id": order_id,
+        "selling_partner_id": selling_partner_id,
+        "marketplace_id": summary.get("MarketplaceId"),
+        "order_status": summary.get("OrderStatus"),
+        "number_of_items_shipped": summary.get("NumberOfItemsShipped"),
+        "total_amount": order_total.get("Amount"),
+        "currency": order_total.get("CurrencyCode"),
+        "purchase_date": parse_amazon_datetime(summary.get("PurchaseDate")),
+        "event_time": parse_amazon_datetime(notification.get("EventTime")) or datetime.min,
+        "notification": notification,
+    }
+
+
+def _upsert_changes(changes):
+    """Apply already-coalesced changes with one lookup query and one commit."""
+    existing_orders = {
+        order.order_id: order
+        for order in AmazonOrders.query.filter(
+            AmazonOrders.order_id.in_([change["order_id"] for change in changes])
+        ).all()
+    }
+
+    affected_sellers = set()
+    for change in changes:
+        order = existing_orders.get(change["order_id"])
+        if order is None:
+            order = AmazonOrders(
+                order_id=change["order_id"],
+                amazon_order_id=change["order_id"],
+                selling_partner_id=change["selling_partner_id"],
+                order_status=change["order_status"] or "UNKNOWN",
+                number_of_items_shipped=change["number_of_items_shipped"] or 0,
+                created_at=datetime.utcnow()
+            )
+            db.session.add(order)
+
+        # Only overwrite the fields the notification actually carried
+        for field in ("marketplace_id", "order_status", "number_of_items_shipped",
+                      "total_amount", "currency", "purchase_date"):
+            if change[field] is not None:
+                setattr(order, field, change[field])
+
+        affected_sellers.add(change["selling_partner_id"])
+
+    db.session.commit()
+    return affected_sellers
+
+
+def apply_order_changes(changes):
+    """Upsert a batch of order changes.
+
+    Returns (affected sellers, number of orders upserted, [(notification, error)] rejected).
+    """
+    # ✅ Coalesce repeated notifications for the same order, latest event wins
+    latest = {}
+    for change in changes:
+        current = latest.get(change["order_id"])
+        if current is None or change["event_time"] >= current["event_time"]:
+            latest[change["order_id"]] = change
+
+    if not latest:
+        return set(), 0, []
+
+    # Orders reference amazon_oauth_tokens, changes for sellers we don't know can never be stored
+    sellers = {change["selling_partner_id"] for change in latest.values()}
+    known_sellers = {
+        seller for (seller,) in db.session.query(AmazonOAuthTokens.selling_partner_id)
+        .filter(AmazonOAuthTokens.selling_partner_id.in_(sellers))
+    }
+    rejected = [
+        (change["notification"], f"unknown seller {change['selling_partner_id']}")
+        for change in latest.values() if change["selling_partner_id"] not in known_sellers
+    ]
+    valid = [change for change in latest.values() if change["selling_partner_id"] in known_sellers]
+    if not valid:
+        return set(), 0, rejected
+
+    try:
+        return _upsert_changes(valid), len(valid), rejected
+    except (IntegrityError, DataError):
+        db.session.rollback()
+
+    # Something in the batch is bad, apply one by one so only the bad changes are rejected
+    affected_sellers, applied = set(), 0
+    for change in valid:
+        try:
+            affected_sellers |= _upsert_changes([change])
+            applied += 1
+        except (IntegrityError, DataError) as e:
+            db.session.rollback()
+            rejected.append((change["notification"], str(getattr(e, "orig", None) or e)[:500]))
+    return affected_sellers, applied, rejected
+
+
+def dead_letter_notifications(redis_client, rejected):
+    """Park notifications that can't be applied so they never block the queue."""
+    if not rejected:
+        return
+    redis_client.rpush(NOTIFICATION_DEAD_KEY, *[
+        json.dumps({"notification": notification, "error": error, "failed_at": datetime.utcnow().isoformat()})
+        for notification, error in rejected
+    ])
+    print(f"❌ Dead-lettered {len(rejected)} order notifications.")
+
+
+def process_notification_batch(redis_client, batch_size=NOTIFICATION_BATCH_SIZE):
+    """Drain one micro-batch from the queue, apply it and invalidate affected sellers' caches."""
+    notifications = pop_notification_batch(redis_client, batch_size)
+    if not notifications:
+        return {"processed": 0, "applied": 0, "rejected": 0, "sellers": []}
+
+    try:
+        changes, rejected = [], []
+        for notification in notifications:
+            try:
+                change = extract_order_change(notification)
+            except (AttributeError, TypeError, ValueError) as e:
+                rejected.append((notification, f"unparseable notification: {e}"))
+                continue
+            if change:
+                changes.append(change)
+
+        affected_sellers, applied, rejected_changes = apply_order_changes(changes)
+        rejected += rejected_changes
+    except Exception as e:
+        db.session.rollback()
+        # Infrastructure failure (DB down etc.), put the batch back so nothing is lost
+        redis_client.lpush(NOTIFICATION_QUEUE_KEY, *[json.dumps(n) for n in reversed(notifications)])
+        print(f"❌ Failed to apply order notifications: {e}")
+        raise
+
+    dead_letter_notifications(redis_client, rejected)
+
+    if affected_sellers:
+        invalidate_orders_cache(redis_client, affected_sellers)
+        refresh_snapshots(redis_client, affected_sellers)
+
+    print(f"✅ Applied {applied} order changes for {len(affected_sellers)} sellers.")
+    return {
+        "processed": len(notifications),
+        "applied": applied,
+        "rejected": len(rejected),
+        "sellers": sorted(affected_sellers),
+    }
@@ -0,0 +1,143 @@
+import re
+import time
+import threading
+from collections import Counter, deque
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SLOW_QUERY_MS = 200          # statements slower than this are logged (and EXPLAINed if enabled)
+N_PLUS_ONE_THRESHOLD = 5     # same statement shape this many times in one request looks like N+1
+RECENT_PROFILES = 50         # request profiles kept in memory for /debug/queries
+DEBUG_HEADER = "X-Debug-Queries"
+
+_recent_profiles = deque(maxlen=RECENT_PROFILES)
+_slow_queries = deque(maxlen=RECENT_PROFILES)
+_lock = threading.Lock()
+_settings = {"explain_slow": False}
+
+_in_list = re.compile(r"\(\s*(%\(\w+\)s|\?|\$\d+|%s)(\s*,\s*(%\(\w+\)s|\?|\$\d+|%s))*\s*\)")
+_whitespace = re.compile(r"\s+")
+_numbered_param = re.compile(r"%\((\w+?)_\d+\)s")
+
+
+def statement_shape(statement):
+    """Normalize a statement so expanded IN lists and numbered params compare equal."""
+    shape = _numbered_param.sub(r"%(\1)s", statement)
+    shape = _in_list.sub("(?)", shape)
+    return _whitespace.sub(" ", shape).strip()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _explain(cursor, statement, parameters):
+    """EXPLAIN ANALYZE on a fresh cursor, SELECTs only since ANALYZE really runs the statement.
+
+    Runs inside a savepoint so a failing EXPLAIN (timeout, cancel) never aborts the request's transaction.
+    """
+    if not statement.lstrip().upper().startswith("SELECT"):
+        return None
+    dbapi_conn = cursor.connection
+    use_savepoint = not getattr(dbapi_conn, "autocommit", False)
+    explain_cursor = dbapi_conn.cursor()
+    try:
+        if use_savepoint:
+            explain_cursor.execute("SAVEPOINT profiler_explain")
+        try:
+            explain_cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+            plan = "\n".join(row[0] for row in explain_cursor.fetchall())
+        except Exception as e:
+            if use_savepoint:
+                explain_cursor.execute("ROLLBACK TO SAVEPOINT profiler_explain")
+            plan = f"EXPLAIN failed: {e}"
+        if use_savepoint:
+            explain_cursor.execute("RELEASE SAVEPOINT profiler_explain")
+        return plan
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+    finally:
+        explain_cursor.close()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+
+    if elapsed_ms >= SLOW_QUERY_MS:
+        slow = {
+            "statement": statement,
+            "duration_ms": round(elapsed_ms, 2),
+            "path": request.path if has_request_context() else None,
+            "plan": _explain(cursor, statement, parameters) if _settings["explain_slow"] and not executemany else None,
+        }
+        with _lock:
+            _slow_queries.append(slow)
+        print(f"🐢 Slow query ({elapsed_ms:.0f} ms): {statement[:200]}")
+
+    if has_request_context():
+        if "query_profile" not in g:
+            g.query_profile = []
+        g.query_profile.append((statement_shape(statement), elapsed_ms))
+
+
+def _handle_error(exception_context):
+    """Failed statements never reach after_cursor_execute, drop their start time."""
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+
+
+def summarize(queries):
+    """Count, total time and repeated statement shapes for one request's queries."""
+    shapes = Counter(shape for shape, _ in queries)
+    time_by_shape = Counter()
+    for shape, elapsed_ms in queries:
+        time_by_shape[shape] += elapsed_ms
+
+    return {
+        "query_count": len(queries),
+        "total_ms": round(sum(elapsed_ms for _, elapsed_ms in queries), 2),
+        "n_plus_one": [
+            {"statement": shape, "count": count, "total_ms": round(time_by_shape[shape], 2)}
+            for shape, count in shapes.most_common() if count >= N_PLUS_ONE_THRESHOLD
+        ],
+        "statements": [
+            {"statement": shape, "count": shapes[shape], "total_ms": round(total, 2)}
+            for shape, total in time_by_shape.most_common()
+        ],
+    }
+
+
+def _after_request(response):
+    queries = g.pop("query_profile", None)
+    if queries is None:
+        return response
+
+    profile = summarize(queries)
+    with _lock:
+        _recent_profiles.append({"method": request.method, "path": request.path, **profile})
+
+    if profile["n_plus_one"]:
+        print(f"⚠️ Possible N+1 on {request.path}: {profile['n_plus_one'][0]['count']}x {profile['n_plus_one'][0]['statement'][:120]}")
+
+    if request.headers.get(DEBUG_HEADER):
+        response.headers["X-Query-Count"] = str(profile["query_count"])
+        response.headers["X-Query-Time-Ms"] = str(profile["total_ms"])
+        response.headers["X-Query-N-Plus-One"] = str(len(profile["n_plus_one"]))
+    return response
+
+
+def recent_profiles():
+    with _lock:
+        return {"requests": list(_recent_profiles), "slow_queries": list(_slow_queries)}
+
+
+def init_query_profiler(app, explain_slow=False):
+    """Hook SQLAlchemy engine events and per-request reporting into the app."""
+    _settings["explain_slow"] = explain_slow
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+    app.after_request(_after_request)
@@ -0,0 +1,130 @@
+import math
+import time
+from collections import defaultdict
+
+# SP-API usage plans (requests per second, burst), per selling partner and operation
+SP_API_QUOTAS = {
+    "getOrders": (0.0167, 20),
+    "createReport": (0.0167, 15),
+    "getReport": (2.0, 15),
+    "getReportDocument": (0.0167, 15),
+}
+DEFAULT_QUOTA = (0.5, 10)
+MAX_QUOTA_WAIT = 120          # seconds a background sync may be queued before giving up
+REQUEST_MAX_QUOTA_WAIT = 10   # web requests must answer well inside gunicorn's 30s worker timeout
+QUOTA_KEY = "sp_api:quota:{selling_partner_id}:{region}:{operation}"  # Amazon meters each region separately
+METRICS_KEY = "sp_api:quota_metrics"
+
+# Reserving token bucket. Tokens may go negative: each caller takes its token immediately
+# and is told how long to wait for it, so callers across all workers are served in arrival
+# order at exactly the quota rate. Returns the wait in ms, or -wait if it would exceed max_wait.
+# Time comes from Redis so every Fly machine shares one clock.
+ACQUIRE_SCRIPT = """
+local rate = tonumber(ARGV[1]) / 1000
+local burst = tonumber(ARGV[2])
+local max_wait = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+
+local wait = 0
+if tokens < 1 then
+    wait = math.ceil((1 - tokens) / rate)
+    if wait > max_wait then
+        return -wait
+    end
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens - 1, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate) + max_wait)
+return wait
+"""
+
+# After a 429 Amazon has no tokens left for us, empty the shared bucket so every worker backs off
+DRAIN_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens')) or 0
+redis.call('HSET', KEYS[1], 'tokens', math.min(tokens, 0), 'ts', now)
+return 1
+"""
+
+_state = {"redis": None, "acquire": None, "drain": None}
+
+
+class QuotaUnavailable(Exception):
+    """The SP-API quota won't free up within the caller's wait limit."""
+
+    def __init__(self, operation, retry_after):
+        super().__init__(f"SP-API quota for {operation} unavailable, retry in {retry_after}s")
+        self.operation = operation
+        self.retry_after = retry_after
+
+
+def init_rate_limiter(redis_client):
+    """Register the Redis client shared by every worker, without it quotas are not enforced."""
+    _state["redis"] = redis_client
+    _state["acquire"] = redis_client.register_script(ACQUIRE_SCRIPT)
+    _state["drain"] = redis_client.register_script(DRAIN_SCRIPT)
+
+
+def _quota_key(selling_partner_id, region, operation):
+    return QUOTA_KEY.format(selling_partner_id=selling_partner_id or "_app", region=region, operation=operation)
+
+
+def _record(operation, **counters):
+    pipe = _state["redis"].pipeline(transaction=False)
+    for name, value in counters.items():
+        pipe.hincrby(METRICS_KEY, f"{operation}:{name}", value)
+    pipe.execute()
+
+
+def acquire_quota(selling_partner_id, operation, region="na", max_wait=REQUEST_MAX_QUOTA_WAIT):
+    """Block until this worker may call the operation for the seller, QuotaUnavailable if the queue is too long."""
+    if _state["redis"] is None:
+        return True
+
+    rate, burst = SP_API_QUOTAS.get(operation, DEFAULT_QUOTA)
+    wait_ms = _state["acquire"](keys=[_quota_key(selling_partner_id, region, operation)],
+                                args=[rate, burst, int(max_wait * 1000)])
+
+    if wait_ms < 0:
+        _record(operation, timeouts=1)
+        print(f"❌ SP-API quota queue for {operation} ({selling_partner_id}, {region}) is longer than {max_wait}s")
+        raise QuotaUnavailable(operation, math.ceil(-wait_ms / 1000))
+
+    if wait_ms:
+        print(f"⏳ Waiting {wait_ms} ms for {operation} quota ({selling_partner_id})")
+        time.sleep(wait_ms / 1000)
+        _record(operation, acquired=1, waited=1, wait_ms=wait_ms)
+    else:
+        _record(operation, acquired=1)
+    return True
+
+
+def report_throttled(selling_partner_id, operation, region="na"):
+    """Called on a 429 so all workers stop spending tokens Amazon says we don't have."""
+    if _state["redis"] is None:
+        return
+    _state["drain"](keys=[_quota_key(selling_partner_id, region, operation)])
+    _record(operation, throttled=1)
+
+
+def quota_metrics():
+    """Per-operation counters: acquired, waited, wait_ms, throttled, timeouts."""
+    if _state["redis"] is None:
+        return {}
+    metrics = defaultdict(dict)
+    for field, value in _state["redis"].hgetall(METRICS_KEY).items():
+        if isinstance(field, bytes):
+            field, value = field.decode(), value.decode()
+        operation, name = field.rsplit(":", 1)
+        metrics[operation][name] = int(value)
+    for counters in metrics.values():
+        if counters.get("waited"):
+            counters["avg_wait_ms"] = round(counters.get("wait_ms", 0) / counters["waited"], 1)
+    return dict(metrics)
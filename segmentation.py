@@ -0,0 +1,299 @@
+import os
+import time
+import uuid
+from datetime import datetime
+from serializers import dumps
+
+try:
+    import pandas as pd
+except ImportError:  # Segmentation is optional, the rest of the app works without pandas
+    pd = None
+
+DEFAULT_DATASET = "retail"
+DATASET_FILES = {"retail": "synthetic_online_retail_data.csv"}
+INGEST_CHUNK_SIZE = 50000
+RESULT_CACHE_TTL = 86400
+INGEST_LOCK_TIMEOUT_MS = 120000   # a crashed worker can't hold a dataset forever
+INGEST_LOCK_WAIT = 60             # seconds to queue behind another ingest of the same dataset
+INGEST_CLAIM_TTL = 6 * 3600       # a source file being ingested, until it is marked done
+RFM_SEGMENTS = [
+    # (segment, min recency score, min frequency+monetary score), first match wins
+    ("Champions", 4, 9),
+    ("Loyal", 3, 7),
+    ("Potential Loyalist", 4, 4),
+    ("Needs Attention", 3, 5),
+    ("At Risk", 1, 7),
+    ("Hibernating", 1, 0),
+]
+
+# Incremental state per dataset, all in Redis so every worker sees the same segments:
+#   customers       hash  customer_id -> "first_date|last_date|frequency|monetary"
+#   months          set   every YYYY-MM with activity
+#   active:<month>  set   customer_ids with an order in that month
+#   order_days      set   "customer_id|YYYY-MM-DD" already counted, so a day split across batches is one order
+#   version         int   bumped on every ingest, result caches are keyed by it
+#   lock            str   held while a batch is merged, the merge is a read-modify-write
+#   source:<file>   str   set once a CSV is fully ingested, ":chunks" counts chunks merged so far
+
+
+def _key(dataset, name):
+    return f"segments:{dataset}:{name}"
+
+
+def _require_pandas():
+    if pd is None:
+        raise RuntimeError("pandas is required for segmentation, install it with `pip install pandas`")
+
+
+def dataset_version(redis_client, dataset=DEFAULT_DATASET):
+    return int(redis_client.get(_key(dataset, "version")) or 0)
+
+
+def _load_customer_states(redis_client, dataset, customer_ids=None):
+    """Customer state as a DataFrame indexed by customer_id (all customers when ids is None)."""
+    key = _key(dataset, "customers")
+    if customer_ids is None:
+        raw = redis_client.hgetall(key)
+    else:
+        raw = dict(zip(customer_ids, redis_client.hmget(key, customer_ids)))
+    raw = {customer_id: state for customer_id, state in raw.items() if state is not None}
+
+    columns = ["first_order", "last_order", "frequency", "monetary"]
+    if not raw:
+        return pd.DataFrame(columns=columns, index=pd.Index([], name="customer_id"))
+
+    states = pd.Series(raw).str.split("|", expand=True)
+    states.columns = columns
+    states.index.name = "customer_id"
+    states["first_order"] = pd.to_datetime(states["first_order"])
+    states["last_order"] = pd.to_datetime(states["last_order"])
+    states["frequency"] = states["frequency"].astype(int)
+    states["monetary"] = states["monetary"].astype(float)
+    return states
+
+
+def _acquire_ingest_lock(redis_client, dataset):
+    """Wait for the dataset's ingest lock and return its token."""
+    token = str(uuid.uuid4())
+    deadline = time.monotonic() + INGEST_LOCK_WAIT
+    while not redis_client.set(_key(dataset, "lock"), token, nx=True, px=INGEST_LOCK_TIMEOUT_MS):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Another ingest into {dataset} is still running")
+        time.sleep(0.1)
+    return token
+
+
+def _release_ingest_lock(redis_client, dataset, token):
+    if redis_client.get(_key(dataset, "lock")) == token:
+        redis_client.delete(_key(dataset, "lock"))
+
+
+def ingest_orders(redis_client, lines, dataset=DEFAULT_DATASET, checkpoint=None):
+    """Fold a batch of order lines (customer_id, order_date, quantity, price) into the RFM and cohort state.
+
+    Only the customers present in the batch are read and rewritten. Lines of one customer on one
+    day count as one order, also across batches. checkpoint=(key, value) is set in the same
+    transaction as the state, so a resumed ingest knows exactly what was merged.
+    """
+    _require_pandas()
+    lines = lines.dropna(subset=["customer_id", "order_date"])
+    if lines.empty:
+        if checkpoint:
+            redis_client.set(*checkpoint)
+        return dataset_version(redis_client, dataset)
+
+    lines = pd.DataFrame({
+        "customer_id": lines["customer_id"].astype("int64").astype(str),
+        "order_date": pd.to_datetime(lines["order_date"]).dt.normalize(),
+        "amount": lines["quantity"].fillna(0) * lines["price"].fillna(0),
+    })
+    orders = lines.groupby(["customer_id", "order_date"], as_index=False)["amount"].sum()
+
+    # Concurrent ingests would each merge into the same old state and the last write would win
+    token = _acquire_ingest_lock(redis_client, dataset)
+    try:
+        version = _merge_orders(redis_client, orders, dataset, checkpoint)
+    finally:
+        _release_ingest_lock(redis_client, dataset, token)
+
+    print(f"✅ Segmentation state for {dataset} updated with {len(orders)} orders (version {version}).")
+    return version
+
+
+def _merge_orders(redis_client, orders, dataset, checkpoint=None):
+    """Fold per-customer-day orders into the stored state, caller holds the dataset lock."""
+    # Customer-days an earlier batch already counted add to monetary but not to frequency
+    order_days = (orders["customer_id"] + "|" + orders["order_date"].dt.strftime("%Y-%m-%d")).tolist()
+    orders["new_order"] = [not seen for seen in redis_client.smismember(_key(dataset, "order_days"), order_days)]
+
+    batch = orders.groupby("customer_id").agg(
+        first_order=("order_date", "min"),
+        last_order=("order_date", "max"),
+        frequency=("new_order", "sum"),
+        monetary=("amount", "sum"),
+    )
+
+    # ✅ Merge with the stored state of just these customers
+    existing = _load_customer_states(redis_client, dataset, list(batch.index))
+    merged = batch
+    if not existing.empty:
+        merged = pd.concat([existing, batch]).groupby(level=0).agg({
+            "first_order": "min",
+            "last_order": "max",
+            "frequency": "sum",
+            "monetary": "sum",
+        })
+    encoded = (
+        merged["first_order"].dt.strftime("%Y-%m-%d") + "|"
+        + merged["last_order"].dt.strftime("%Y-%m-%d") + "|"
+        + merged["frequency"].astype(int).astype(str) + "|"
+        + merged["monetary"].round(2).astype(str)
+    )
+
+    orders["month"] = orders["order_date"].dt.strftime("%Y-%m")
+    activity = orders.drop_duplicates(["customer_id", "month"]).groupby("month")["customer_id"].agg(list)
+
+    pipe = redis_client.pipeline()
+    pipe.hset(_key(dataset, "customers"), mapping=encoded.to_dict())
+    pipe.sadd(_key(dataset, "order_days"), *order_days)
+    pipe.sadd(_key(dataset, "months"), *activity.index)
+    for month, customer_ids in activity.items():
+        pipe.sadd(_key(dataset, f"active:{month}"), *customer_ids)
+    if checkpoint:
+        pipe.set(*checkpoint)
+    pipe.incr(_key(dataset, "version"))
+    return pipe.execute()[-1]
+
+
+def ingest_csv(redis_client, file_path, dataset=DEFAULT_DATASET, chunk_size=INGEST_CHUNK_SIZE):
+    """Stream a retail CSV into the segmentation state chunk by chunk."""
+    _require_pandas()
+    version = dataset_version(redis_client, dataset)
+
+    # Re-ingesting the same file would double count, remember which file versions were folded in
+    stat = os.stat(file_path)
+    source_key = _key(dataset, f"source:{os.path.basename(file_path)}:{stat.st_size}:{int(stat.st_mtime)}")
+    chunks_key, running_key = f"{source_key}:chunks", f"{source_key}:running"
+    if redis_client.exists(source_key):
+        print(f"🔍 {file_path} was already ingested into {dataset}, skipping.")
+        return version
+
+    # Claimed while running so a second request doesn't ingest it too
+    if not redis_client.set(running_key, 1, nx=True, ex=INGEST_CLAIM_TTL):
+        print(f"🔍 {file_path} is being ingested into {dataset}, skipping.")
+        return version
+
+    try:
+        # A failed earlier attempt already merged some chunks, resume after them
+        done_chunks = int(redis_client.get(chunks_key) or 0)
+        if done_chunks:
+            print(f"⏳ Resuming {file_path} after {done_chunks} ingested chunks.")
+        chunks = pd.read_csv(file_path, usecols=["customer_id", "order_date", "quantity", "price"],
+                             chunksize=chunk_size)
+        for index, chunk in enumerate(chunks):
+            if index < done_chunks:
+                continue
+            version = ingest_orders(redis_client, chunk, dataset, checkpoint=(chunks_key, index + 1))
+
+        pipe = redis_client.pipeline()
+        pipe.set(source_key, datetime.utcnow().isoformat())
+        pipe.delete(chunks_key)
+        pipe.execute()
+    finally:
+        redis_client.delete(running_key)
+    return version
+
+
+def _quintile_scores(values, ascending=True):
+    """1-5 scores by quintile, ranking first so ties and small datasets still split evenly."""
+    ranks = values.rank(method="first", ascending=ascending)
+    return pd.qcut(ranks, min(5, len(values)), labels=False) + 1
+
+
+def compute_rfm(redis_client, dataset=DEFAULT_DATASET, as_of=None):
+    """Score every customer 1-5 on recency, frequency and monetary and assign a segment."""
+    _require_pandas()
+    customers = _load_customer_states(redis_client, dataset)
+    if customers.empty:
+        return {"customers": [], "segments": {}}
+
+    as_of = pd.Timestamp(as_of or datetime.utcnow().date())
+    customers["recency_days"] = (as_of - customers["last_order"]).dt.days
+
+    customers["r_score"] = _quintile_scores(customers["recency_days"], ascending=False)
+    customers["f_score"] = _quintile_scores(customers["frequency"])
+    customers["m_score"] = _quintile_scores(customers["monetary"])
+
+    fm_score = customers["f_score"] + customers["m_score"]
+    customers["segment"] = "Hibernating"
+    assigned = pd.Series(False, index=customers.index)
+    for segment, min_r, min_fm in RFM_SEGMENTS:
+        match = ~assigned & (customers["r_score"] >= min_r) & (fm_score >= min_fm)
+        customers.loc[match, "segment"] = segment
+        assigned |= match
+
+    customers = customers.reset_index()
+    customers["first_order"] = customers["first_order"].dt.strftime("%Y-%m-%d")
+    customers["last_order"] = customers["last_order"].dt.strftime("%Y-%m-%d")
+    return {
+        "as_of": as_of.strftime("%Y-%m-%d"),
+        "segments": customers["segment"].value_counts().to_dict(),
+        "customers": customers[[
+            "customer_id", "recency_days", "frequency", "monetary",
+            "r_score", "f_score", "m_score", "segment", "first_order", "last_order",
+        ]].to_dict(orient="records"),
+    }
+
+
+def compute_cohorts(redis_client, dataset=DEFAULT_DATASET):
+    """Monthly acquisition cohorts with the share of each cohort active N months later."""
+    _require_pandas()
+    customers = _load_customer_states(redis_client, dataset)
+    months = sorted(redis_client.smembers(_key(dataset, "months")))
+    if customers.empty or not months:
+        return {"cohorts": []}
+
+    pipe = redis_client.pipeline(transaction=False)
+    for month in months:
+        pipe.smembers(_key(dataset, f"active:{month}"))
+    activity = pd.DataFrame(
+        [(customer_id, month) for month, members in zip(months, pipe.execute()) for customer_id in members],
+        columns=["customer_id", "month"],
+    )
+
+    first_month = customers["first_order"].dt.year * 12 + customers["first_order"].dt.month - 1
+    month_index = activity["month"].str[:4].astype(int) * 12 + activity["month"].str[5:7].astype(int) - 1
+    activity["cohort_index"] = activity["customer_id"].map(first_month)
+    activity["period"] = month_index - activity["cohort_index"]
+    activity = activity[activity["period"] >= 0]
+
+    counts = pd.crosstab(activity["cohort_index"], activity["period"])
+    sizes = counts[0]
+    retention = counts.div(sizes, axis=0).round(4)
+
+    return {
+        "periods": [int(period) for period in retention.columns],
+        "cohorts": [
+            {
+                "cohort": f"{cohort_index // 12:04d}-{cohort_index % 12 + 1:02d}",
+                "size": int(sizes[cohort_index]),
+                "retention": [float(value) for value in retention.loc[cohort_index]],
+            }
+            for cohort_index in retention.index
+        ],
+    }
+
+
+def cached_result(redis_client, kind, compute, dataset=DEFAULT_DATASET):
+    """Serialized result for the current dataset version, computed at most once per version.
+
+    kind must include every input besides the state, e.g. the RFM as_of date.
+    """
+    version = dataset_version(redis_client, dataset)
+    cache_key = _key(dataset, f"cache:{kind}:{version}")
+    payload = redis_client.get(cache_key)
+    if payload is None:
+        result = compute(redis_client, dataset)
+        payload = dumps({"dataset": dataset, "version": version, **result})
+        redis_client.setex(cache_key, RESULT_CACHE_TTL, payload)
+    return version, payload
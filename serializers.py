@@ -0,0 +1,110 @@
+import json
+from decimal import Decimal
+from datetime import date, datetime
+from flask import Response
+from models import db, AmazonOrders, AmazonSettlementData
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib encoder when orjson isn't installed
+    orjson = None
+
+# Columns returned by /get-orders, same keys and values as AmazonOrders.to_dict
+ORDER_COLUMNS = (
+    AmazonOrders.id,
+    AmazonOrders.order_id,
+    AmazonOrders.amazon_order_id,
+    AmazonOrders.selling_partner_id,
+    AmazonOrders.marketplace_id,
+    AmazonOrders.number_of_items_shipped,
+    AmazonOrders.order_status,
+    db.func.nullif(AmazonOrders.total_amount, 0).label("total_amount"),  # to_dict gives null for 0
+    AmazonOrders.currency,
+    AmazonOrders.purchase_date,
+    AmazonOrders.created_at,
+)
+
+# Columns returned by /api/orders, 0 for a missing total and purchase_date cast to a date (YYYY-MM-DD)
+ORDER_SUMMARY_COLUMNS = (
+    AmazonOrders.marketplace_id,
+    db.func.coalesce(AmazonOrders.total_amount, 0).label("total_amount"),
+    AmazonOrders.order_status,
+    db.cast(AmazonOrders.purchase_date, db.Date).label("purchase_date"),
+)
+
+# Same keys and values as AmazonSettlementData.to_dict
+SETTLEMENT_COLUMNS = (
+    AmazonSettlementData.id,
+    AmazonSettlementData.selling_partner_id,
+    AmazonSettlementData.settlement_id,
+    AmazonSettlementData.date_time,
+    AmazonSettlementData.order_id,
+    AmazonSettlementData.type,
+    db.func.nullif(AmazonSettlementData.amount, 0).label("amount"),
+    db.func.nullif(AmazonSettlementData.amazon_fee, 0).label("amazon_fee"),
+    db.func.nullif(AmazonSettlementData.shipping_fee, 0).label("shipping_fee"),
+    db.func.nullif(AmazonSettlementData.total_amount, 0).label("total_amount"),
+    AmazonSettlementData.created_at,
+)
+
+
+def _default(value):
+    """Handle the types neither encoder knows natively."""
+    if isinstance(value, Decimal):
+        return float(value)
+    # Same formats the models' to_dict always returned, clients parse these
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    if hasattr(value, "item"):  # numpy scalars coming out of pandas
+        return value.item()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(data):
+    """Serialize to JSON bytes using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(data, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def null_zero_amounts(rows, fields=("total_amount",)):
+    """Zero amounts serialize as null, like to_dict, for rows that didn't come from the column tuples."""
+    for row in rows:
+        for field in fields:
+            if not row.get(field):
+                row[field] = None
+    return rows
+
+
+def json_response(data, status=200):
+    """Drop-in replacement for jsonify() that goes through the fast encoder."""
+    return Response(dumps(data), status=status, mimetype="application/json")
+
+
+def raw_json_response(payload, status=200):
+    """Return an already serialized JSON document (e.g. straight from Redis) without re-encoding."""
+    return Response(payload, status=status, mimetype="application/json")
+
+
+def select_rows(columns, *filters):
+    """Run a column-only query and return plain dicts, skipping ORM object construction."""
+    query = db.select(*columns)
+    if filters:
+        query = query.where(*filters)
+    result = db.session.execute(query)
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+def fetch_orders_rows(*filters):
+    return select_rows(ORDER_COLUMNS, *filters)
+
+
+def fetch_order_summary_rows(*filters):
+    return select_rows(ORDER_SUMMARY_COLUMNS, *filters)
+
+
+def fetch_settlement_rows(*filters):
+    return select_rows(SETTLEMENT_COLUMNS, *filters)
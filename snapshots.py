@@ -0,0 +1,157 @@
+import hashlib
+from datetime import datetime, timedelta
+from models import db, AmazonOrders, AmazonSettlementData
+from serializers import ORDER_COLUMNS, dumps
+from archive import read_archive, rearrived_keys
+
+# One pre-serialized dashboard document per seller, stored as a hash with "body" and "etag"
+SNAPSHOT_KEY = "snapshot:{selling_partner_id}"
+RECENT_ORDERS_LIMIT = 20
+SNAPSHOT_TTL = 86400  # the 365/30 day windows move, rebuild at least daily and drop unused sellers
+
+
+def snapshot_key(selling_partner_id):
+    return SNAPSHOT_KEY.format(selling_partner_id=selling_partner_id)
+
+
+def _archived_orders(selling_partner_id, since):
+    """Orders in the window that already moved to the archive, minus ones a sync re-inserted."""
+    archived = read_archive("amazon_orders", since, selling_partner_id=selling_partner_id,
+                            columns=["total_amount", "number_of_items_shipped", "order_status", "purchase_date"])
+    if not archived:
+        return []
+    rearrived = rearrived_keys("amazon_orders", selling_partner_id)
+    return [order for order in archived if order["order_id"] not in rearrived]
+
+
+def _order_kpis(selling_partner_id, since, archived):
+    row = db.session.execute(
+        db.select(
+            db.func.count(AmazonOrders.id),
+            db.func.coalesce(db.func.sum(AmazonOrders.total_amount), 0),
+            db.func.coalesce(db.func.sum(AmazonOrders.number_of_items_shipped), 0),
+            db.func.max(AmazonOrders.purchase_date),
+        ).where(
+            AmazonOrders.selling_partner_id == selling_partner_id,
+            AmazonOrders.purchase_date >= since
+        )
+    ).one()
+    order_count, revenue, items_shipped, last_order_at = row
+    if archived:
+        order_count += len(archived)
+        revenue = float(revenue) + sum(order["total_amount"] or 0 for order in archived)
+        items_shipped += sum(order["number_of_items_shipped"] or 0 for order in archived)
+        last_order_at = max(filter(None, [last_order_at, *(order["purchase_date"] for order in archived)]),
+                            default=None)
+    return {
+        "orders": order_count,
+        "revenue": revenue,
+        "items_shipped": items_shipped,
+        "average_order_value": (revenue / order_count) if order_count else 0,
+        "last_order_at": last_order_at,
+    }
+
+
+def _status_counts(selling_partner_id, since, archived):
+    rows = db.session.execute(
+        db.select(AmazonOrders.order_status, db.func.count(AmazonOrders.id))
+        .where(
+            AmazonOrders.selling_partner_id == selling_partner_id,
+            AmazonOrders.purchase_date >= since
+        )
+        .group_by(AmazonOrders.order_status)
+    )
+    counts = {status: count for status, count in rows}
+    for order in archived:
+        counts[order["order_status"]] = counts.get(order["order_status"], 0) + 1
+    return counts
+
+
+def _recent_orders(selling_partner_id):
+    result = db.session.execute(
+        db.select(*ORDER_COLUMNS)
+        .where(AmazonOrders.selling_partner_id == selling_partner_id)
+        .order_by(AmazonOrders.purchase_date.desc())
+        .limit(RECENT_ORDERS_LIMIT)
+    )
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+def _settlement_totals(selling_partner_id, since):
+    row = db.session.execute(
+        db.select(
+            db.func.count(AmazonSettlementData.id),
+            db.func.coalesce(db.func.sum(AmazonSettlementData.amount), 0),
+            db.func.coalesce(db.func.sum(AmazonSettlementData.amazon_fee), 0),
+            db.func.coalesce(db.func.sum(AmazonSettlementData.shipping_fee), 0),
+            db.func.coalesce(db.func.sum(AmazonSettlementData.total_amount), 0),
+        ).where(
+            AmazonSettlementData.selling_partner_id == selling_partner_id,
+            AmazonSettlementData.date_time >= since
+        )
+    ).one()
+    totals = dict(zip(("rows", "amount", "amazon_fee", "shipping_fee", "total_amount"), row))
+
+    # Only reached when the hot window is shorter than 30 days
+    for line in read_archive("amazon_settlement_data", since, selling_partner_id=selling_partner_id,
+                             columns=["amount", "amazon_fee", "shipping_fee", "total_amount"]):
+        totals["rows"] += 1
+        for field in ("amount", "amazon_fee", "shipping_fee", "total_amount"):
+            totals[field] += line[field] or 0
+    return totals
+
+
+def build_snapshot(selling_partner_id):
+    """Compute the full dashboard document for one seller with a handful of aggregate queries."""
+    now = datetime.utcnow()
+    one_year_ago = now - timedelta(days=365)
+    # The 365-day KPIs reach into the archive once the hot window is shorter than a year
+    archived = _archived_orders(selling_partner_id, one_year_ago)
+    return {
+        "selling_partner_id": selling_partner_id,
+        "generated_at": now,
+        "kpis": _order_kpis(selling_partner_id, one_year_ago, archived),
+        "status_counts": _status_counts(selling_partner_id, one_year_ago, archived),
+        "recent_orders": _recent_orders(selling_partner_id),
+        "settlements_last_30_days": _settlement_totals(selling_partner_id, now - timedelta(days=30)),
+    }
+
+
+def _etag_for(snapshot):
+    """ETag over the data only, so a recompute that changes nothing keeps the same validator."""
+    content = {key: value for key, value in snapshot.items() if key != "generated_at"}
+    return hashlib.sha1(dumps(content)).hexdigest()
+
+
+def refresh_snapshot(redis_client, selling_partner_id):
+    """Recompute one seller's snapshot and store it, the stored copy is untouched if nothing changed."""
+    snapshot = build_snapshot(selling_partner_id)
+    etag = _etag_for(snapshot)
+    key = snapshot_key(selling_partner_id)
+
+    pipe = redis_client.pipeline()
+    if redis_client.hget(key, "etag") != etag:
+        pipe.hset(key, mapping={"etag": etag, "body": dumps(snapshot)})
+    pipe.expire(key, SNAPSHOT_TTL)
+    pipe.execute()
+    return etag
+
+
+def refresh_snapshots(redis_client, selling_partner_ids):
+    """Refresh only the sellers touched by a sync, failures never break the sync itself."""
+    for selling_partner_id in selling_partner_ids:
+        try:
+            refresh_snapshot(redis_client, selling_partner_id)
+        except Exception as e:
+            print(f"❌ Failed to refresh snapshot for {selling_partner_id}: {e}")
+
+
+def get_snapshot(redis_client, selling_partner_id):
+    """Return (etag, body) for a seller, building the snapshot on first access or once it expired."""
+    key = snapshot_key(selling_partner_id)
+    etag, body = redis_client.hmget(key, "etag", "body")
+    if etag is None or body is None:
+        refresh_snapshot(redis_client, selling_partner_id)
+        etag, body = redis_client.hmget(key, "etag", "body")
+    return etag, body
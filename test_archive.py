@@ -0,0 +1,63 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from flask import Flask
+
+import archive
+from models import db, AmazonOAuthTokens, AmazonOrders
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add(AmazonOAuthTokens("SELLER1", "access", "refresh", 3600))
+        db.session.commit()
+        yield app
+        db.session.remove()
+
+
+def test_archive_orders_round_trip_with_amount(app):
+    purchase_date = datetime(2020, 3, 15, 10, 30)
+    db.session.add(AmazonOrders(
+        order_id="111-1", amazon_order_id="111-1", selling_partner_id="SELLER1",
+        marketplace_id="A1AM78C64UM0Y8", number_of_items_shipped=2, order_status="Shipped",
+        total_amount=12.5, currency="MXN", purchase_date=purchase_date, created_at=purchase_date,
+    ))
+    db.session.commit()
+
+    assert archive.archive_table("amazon_orders", cutoff=datetime(2021, 1, 1)) == 1
+    assert AmazonOrders.query.count() == 0
+
+    rows = archive.read_archive("amazon_orders", selling_partner_id="SELLER1")
+    assert len(rows) == 1
+    assert rows[0]["order_id"] == "111-1"
+    assert rows[0]["total_amount"] == 12.5
+    assert rows[0]["purchase_date"] == purchase_date
+
+
+def test_merge_with_archive_prefers_hot_copy(app):
+    purchase_date = datetime(2020, 3, 15, 10, 30)
+    db.session.add(AmazonOrders(
+        order_id="111-2", amazon_order_id="111-2", selling_partner_id="SELLER1",
+        order_status="Pending", total_amount=5, purchase_date=purchase_date,
+    ))
+    db.session.commit()
+    archive.archive_table("amazon_orders", cutoff=datetime(2021, 1, 1))
+
+    hot = [{"id": 99, "order_id": "111-2", "order_status": "Shipped"}]
+    merged = archive.merge_with_archive(hot, "amazon_orders", selling_partner_id="SELLER1")
+    assert merged == hot
+
+
+def test_archive_requires_archive_dir(app, monkeypatch):
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", None)
+    with pytest.raises(RuntimeError):
+        archive.archive_table("amazon_orders")
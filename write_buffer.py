@@ -0,0 +1,292 @@
+import json
+import time
+import uuid
+import threading
+from datetime import datetime
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError, DataError
+from models import db, AmazonOrders, AmazonSettlementData
+from snapshots import refresh_snapshots
+from http_cache import invalidate_orders_cache
+from notifications import notifications_due, process_notification_batch
+
+# Pending records live in Redis hashes so a crashed worker never loses them.
+# Orders are keyed by order_id, so repeated writes for one order coalesce to the latest,
+# settlement rows by seller, settlement and report line, so every line is kept but re-queueing
+# the same report coalesces. Rows Postgres rejects end up in "<buffer>:dead".
+ORDERS_BUFFER_KEY = "write_buffer:orders"
+SETTLEMENTS_BUFFER_KEY = "write_buffer:settlements"
+FLUSH_LOCK_KEY = "write_buffer:flush_lock"
+
+FLUSH_SIZE = 500            # flush as soon as this many records are pending
+FLUSH_INTERVAL = 5          # ...or once the oldest pending record is this many seconds old
+MAX_PENDING = 50000         # reject new writes above this to protect Redis and Postgres
+DB_CHUNK_SIZE = 1000
+FLUSH_LOCK_TIMEOUT_MS = 60000
+
+ORDER_FIELDS = ("order_id", "amazon_order_id", "marketplace_id", "selling_partner_id",
+                "number_of_items_shipped", "order_status", "total_amount", "currency",
+                "purchase_date", "created_at")
+SETTLEMENT_FIELDS = ("selling_partner_id", "settlement_id", "date_time", "order_id", "type",
+                     "amount", "amazon_fee", "shipping_fee", "total_amount", "created_at")
+DATETIME_FIELDS = ("purchase_date", "created_at", "date_time")
+
+
+class WriteBufferFull(Exception):
+    """Raised when the pending buffer is over MAX_PENDING, callers should retry later."""
+
+
+def _since_key(buffer_key):
+    return f"{buffer_key}:since"
+
+
+def _flushing_key(buffer_key):
+    return f"{buffer_key}:flushing"
+
+
+def _dead_key(buffer_key):
+    return f"{buffer_key}:dead"
+
+
+def _encode(record):
+    return json.dumps({
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in record.items()
+    })
+
+
+def _decode(raw):
+    record = json.loads(raw)
+    for field in DATETIME_FIELDS:
+        if record.get(field):
+            try:
+                record[field] = datetime.fromisoformat(record[field])
+            except ValueError:
+                pass  # Raw report strings are left for Postgres to parse
+    return record
+
+
+def normalize_order(selling_partner_id, order):
+    """Map an SP-API order dict to amazon_orders columns."""
+    order_total = order.get("OrderTotal") or {}
+    purchase_date = order.get("PurchaseDate")
+    return {
+        "order_id": order.get("AmazonOrderId"),
+        "amazon_order_id": order.get("AmazonOrderId"),
+        "marketplace_id": order.get("MarketplaceId"),
+        "selling_partner_id": selling_partner_id,
+        "number_of_items_shipped": order.get("NumberOfItemsShipped", 0),
+        "order_status": order.get("OrderStatus", "UNKNOWN"),
+        "total_amount": float(order_total.get("Amount", 0) or 0),
+        "currency": order_total.get("CurrencyCode"),
+        "purchase_date": datetime.strptime(purchase_date, "%Y-%m-%dT%H:%M:%SZ") if purchase_date else None,
+        "created_at": datetime.utcnow(),
+    }
+
+
+def normalize_settlement(selling_partner_id, row):
+    """Map a settlement report CSV row to amazon_settlement_data columns."""
+    record = {field: (row.get(field) or None) for field in SETTLEMENT_FIELDS}
+    record["selling_partner_id"] = selling_partner_id
+    record["created_at"] = datetime.utcnow()
+    return record
+
+
+def _buffer(redis_client, buffer_key, keyed_records, check_capacity=True):
+    if not keyed_records:
+        return 0
+
+    if check_capacity and redis_client.hlen(buffer_key) >= MAX_PENDING:
+        raise WriteBufferFull(f"{buffer_key} has {MAX_PENDING}+ pending records")
+
+    pipe = redis_client.pipeline()
+    pipe.hset(buffer_key, mapping={key: _encode(record) for key, record in keyed_records.items()})
+    pipe.set(_since_key(buffer_key), time.time(), nx=True)
+    pipe.hlen(buffer_key)
+    _, _, pending = pipe.execute()
+    return pending
+
+
+def buffer_orders(redis_client, selling_partner_id, orders):
+    """Queue SP-API orders for a write-behind upsert, returns the normalized records."""
+    records = [normalize_order(selling_partner_id, order) for order in orders if order.get("AmazonOrderId")]
+    _buffer(redis_client, ORDERS_BUFFER_KEY, {record["order_id"]: record for record in records})
+    return records
+
+
+def reserve_settlement_capacity(redis_client, rows):
+    """Fail before anything is queued when a whole report won't fit, so a retry never re-queues half of one.
+
+    An empty buffer always takes the report, however large, or it could never be ingested.
+    """
+    pending = redis_client.hlen(SETTLEMENTS_BUFFER_KEY)
+    if pending and pending + rows > MAX_PENDING:
+        raise WriteBufferFull(f"{SETTLEMENTS_BUFFER_KEY} can't take {rows} more records")
+
+
+def settlement_buffer_key(selling_partner_id, settlement_id, line_number):
+    return f"{selling_partner_id}:{settlement_id}:{line_number}"
+
+
+def buffer_settlements(redis_client, keyed_records):
+    """Queue {settlement_buffer_key: record} for a write-behind insert, capacity is reserved up front."""
+    return _buffer(redis_client, SETTLEMENTS_BUFFER_KEY, keyed_records, check_capacity=False)
+
+
+def _write_orders(records):
+    statement = insert(AmazonOrders).values(records)
+    statement = statement.on_conflict_do_update(
+        index_elements=[AmazonOrders.order_id],
+        set_={
+            field: statement.excluded[field]
+            for field in ORDER_FIELDS if field not in ("order_id", "amazon_order_id", "created_at")
+        }
+    )
+    db.session.execute(statement)
+    db.session.commit()
+
+
+def _write_settlements(records):
+    db.session.execute(insert(AmazonSettlementData), records)
+    db.session.commit()
+
+
+def _write_or_dead_letter(redis_client, buffer_key, writer, records):
+    """Write records, bisecting on bad data so only the offending rows go to the dead-letter list.
+
+    Returns the records that were committed. Connection-level errors are re-raised so the
+    snapshot is kept and retried instead of being dead-lettered.
+    """
+    try:
+        writer(records)
+        return records
+    except (IntegrityError, DataError) as e:
+        db.session.rollback()
+        if len(records) == 1:
+            redis_client.rpush(_dead_key(buffer_key), json.dumps({
+                "record": json.loads(_encode(records[0])),
+                "error": str(e.orig if getattr(e, "orig", None) else e)[:500],
+                "failed_at": datetime.utcnow().isoformat(),
+            }))
+            print(f"❌ Dead-lettered a record from {buffer_key}: {e.orig if getattr(e, 'orig', None) else e}")
+            return []
+    except Exception:
+        db.session.rollback()
+        raise
+
+    middle = len(records) // 2
+    return (_write_or_dead_letter(redis_client, buffer_key, writer, records[:middle])
+            + _write_or_dead_letter(redis_client, buffer_key, writer, records[middle:]))
+
+
+def _renew_flush_lock(redis_client, token):
+    """Extend our flush lock before each chunk, False when another flusher has taken over."""
+    if redis_client.get(FLUSH_LOCK_KEY) != token:
+        return False
+    redis_client.pexpire(FLUSH_LOCK_KEY, FLUSH_LOCK_TIMEOUT_MS)
+    return True
+
+
+def _flush_buffer(redis_client, buffer_key, writer, token):
+    flushing_key = _flushing_key(buffer_key)
+
+    # A leftover snapshot means a previous flush died mid-write, retry it before newer data
+    if not redis_client.exists(flushing_key):
+        if not redis_client.exists(buffer_key):
+            return []
+        pipe = redis_client.pipeline()
+        pipe.rename(buffer_key, flushing_key)
+        pipe.delete(_since_key(buffer_key))
+        pipe.execute()
+
+    written = []
+    snapshot = redis_client.hgetall(flushing_key)
+    keys = list(snapshot)
+    for start in range(0, len(keys), DB_CHUNK_SIZE):
+        # A flush longer than the lock timeout would let a second worker re-write this snapshot
+        if not _renew_flush_lock(redis_client, token):
+            print(f"⚠️ Lost the flush lock while flushing {buffer_key}, leaving the rest to the new flusher.")
+            return written
+        chunk_keys = keys[start:start + DB_CHUNK_SIZE]
+        records = [_decode(snapshot[key]) for key in chunk_keys]
+        written += _write_or_dead_letter(redis_client, buffer_key, writer, records)
+        # Committed chunks leave the snapshot so a crash later never re-inserts them
+        redis_client.hdel(flushing_key, *chunk_keys)
+
+    redis_client.delete(flushing_key)
+    return written
+
+
+def flush(redis_client):
+    """Write all pending records to Postgres, only one flusher runs at a time across workers."""
+    token = str(uuid.uuid4())
+    if not redis_client.set(FLUSH_LOCK_KEY, token, nx=True, px=FLUSH_LOCK_TIMEOUT_MS):
+        return None
+
+    try:
+        orders = _flush_buffer(redis_client, ORDERS_BUFFER_KEY, _write_orders, token)
+        settlements = _flush_buffer(redis_client, SETTLEMENTS_BUFFER_KEY, _write_settlements, token)
+    finally:
+        if redis_client.get(FLUSH_LOCK_KEY) == token:
+            redis_client.delete(FLUSH_LOCK_KEY)
+
+    # Cached order lists of sellers whose orders just landed are now stale
+    sellers = {record["selling_partner_id"] for record in orders}
+    invalidate_orders_cache(redis_client, sellers)
+
+    refresh_snapshots(redis_client, sellers | {record["selling_partner_id"] for record in settlements})
+
+    flushed = {"orders": len(orders), "settlements": len(settlements)}
+
+    if any(flushed.values()):
+        print(f"✅ Write buffer flushed: {flushed['orders']} orders, {flushed['settlements']} settlement rows.")
+    return flushed
+
+
+def flush_due(redis_client, buffer_key):
+    """True when the buffer has hit the size trigger or its oldest record hit the time trigger."""
+    pipe = redis_client.pipeline()
+    pipe.hlen(buffer_key)
+    pipe.get(_since_key(buffer_key))
+    pipe.exists(_flushing_key(buffer_key))
+    pending, since, leftover = pipe.execute()
+    if leftover:
+        return True
+    if not pending:
+        return False
+    return pending >= FLUSH_SIZE or (since is not None and time.time() - float(since) >= FLUSH_INTERVAL)
+
+
+def pending_counts(redis_client):
+    return {
+        "orders": redis_client.hlen(ORDERS_BUFFER_KEY),
+        "settlements": redis_client.hlen(SETTLEMENTS_BUFFER_KEY),
+        "orders_dead": redis_client.llen(_dead_key(ORDERS_BUFFER_KEY)),
+        "settlements_dead": redis_client.llen(_dead_key(SETTLEMENTS_BUFFER_KEY)),
+    }
+
+
+def _flush_loop(app, redis_client, poll_interval):
+    while True:
+        try:
+            if flush_due(redis_client, ORDERS_BUFFER_KEY) or flush_due(redis_client, SETTLEMENTS_BUFFER_KEY):
+                with app.app_context():
+                    flush(redis_client)
+        except Exception as e:
+            print(f"❌ Write buffer flush failed: {e}")
+        try:
+            # Small notification backlogs never reach the batch size, apply them once they are old enough
+            if notifications_due(redis_client):
+                with app.app_context():
+                    process_notification_batch(redis_client)
+        except Exception as e:
+            print(f"❌ Applying order notifications failed: {e}")
+        time.sleep(poll_interval)
+
+
+def start_flush_worker(app, redis_client, poll_interval=1):
+    """Start the background flusher thread for this process."""
+    worker = threading.Thread(target=_flush_loop, args=(app, redis_client, poll_interval),
+                              name="write-buffer-flusher", daemon=True)
+    worker.start()
+    return worker